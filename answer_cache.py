@@ -0,0 +1,113 @@
+import os
+import threading
+
+import numpy as np
+
+
+
+class AnswerCache:
+    # semantic cache of final responses, keyed by query embedding similarity
+    # a stored response is reused when a new query is close enough to a cached one
+    # and retrieval returned (nearly) the same chunks for both
+
+    def __init__(self, max_size=1024, threshold=0.95, min_context_overlap=0.8):
+        self.max_size = max_size
+        self.threshold = threshold                      # cosine similarity between the two queries
+        self.min_context_overlap = min_context_overlap  # jaccard overlap of the retrieved chunk ids
+        self.lock = threading.Lock()
+        self.version = None
+        self.stats = dict(hits = 0, misses = 0, evictions = 0)
+        self._reset()
+
+
+    def _reset(self):
+        self.vectors = None         # (max_size, d) unit-length query embeddings
+        self.chunk_ids = list()     # frozenset of retrieved chunk ids per slot
+        self.responses = list()     # stored response per slot
+        self.last_used = np.zeros(self.max_size, dtype=np.int64)
+        self.clock = 0              # increments on every use, smallest last_used is evicted
+
+
+    def _check_version(self, index_version):
+        # answers built on an older index are dropped as a whole
+        if index_version != self.version:
+            self._reset()
+            self.version = index_version
+
+
+    def lookup(self, query_embedding, chunk_ids, index_version=None):
+        query = self._normalize(query_embedding)
+        with self.lock:
+            self._check_version(index_version)
+            if not self.responses:
+                self.stats['misses'] += 1
+                return None
+
+            # nearest cached query by cosine similarity
+            similarities = self.vectors[:len(self.responses)] @ query
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < self.threshold or not self._context_matches(self.chunk_ids[slot], chunk_ids):
+                self.stats['misses'] += 1
+                return None
+
+            self.clock += 1
+            self.last_used[slot] = self.clock
+            self.stats['hits'] += 1
+            return self.responses[slot]
+
+
+    def store(self, query_embedding, chunk_ids, response, index_version=None):
+        query = self._normalize(query_embedding)
+        with self.lock:
+            self._check_version(index_version)
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_size, query.shape[0]), dtype=np.float32)
+
+            # append while there is room, else overwrite the least recently used slot
+            if len(self.responses) < self.max_size:
+                slot = len(self.responses)
+                self.chunk_ids.append(None)
+                self.responses.append(None)
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.stats['evictions'] += 1
+
+            self.vectors[slot] = query
+            self.chunk_ids[slot] = frozenset(int(i) for i in chunk_ids)
+            self.responses[slot] = response
+            self.clock += 1
+            self.last_used[slot] = self.clock
+
+
+    def _context_matches(self, cached_ids, chunk_ids):
+        chunk_ids = {int(i) for i in chunk_ids}
+        union = cached_ids | chunk_ids
+        if not union:
+            return True
+        return len(cached_ids & chunk_ids) / len(union) >= self.min_context_overlap
+
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+
+# process-wide cache, shared by all requests of the worker
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    # ANSWER_CACHE_SIZE=0 turns the cache off
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(
+                    max_size = int(os.environ.get('ANSWER_CACHE_SIZE', 1024)),
+                    threshold = float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95)),
+                    min_context_overlap = float(os.environ.get('ANSWER_CACHE_OVERLAP', 0.8))
+                )
+    return _cache if _cache.max_size > 0 else None
@@ -1,18 +1,69 @@
-from flask import Flask, request, jsonify
-from solution_creator import SolutionCreator
+import os
+import uuid
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+from solution_creator import SolutionCreator, format_sse
 from flask_cors import CORS  # Import CORS
+import metrics
+import cold_start
 
 
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Request-ID', 'Server-Timing'])
+
+# per-stage timings in a Server-Timing header on every response, otherwise only with ?timing=true
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# serverless cold start: load indexes and sdks in the background while the first request comes in
+if cold_start.WARM_UP:
+    cold_start.start_warm_up()
 
 @app.post('/api') 
 def api():
     query = request.get_json()
     sc = SolutionCreator()
-    solution = sc.create_solution(query)
-    return jsonify(solution)
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+
+    # opt-in streaming: links first, then answer tokens as server-sent events
+    if request.args.get('stream') == 'true' or query.get('stream'):
+        return Response(
+            stream_with_context(_sse_events(sc, query, request_id)),
+            mimetype = 'text/event-stream',
+            headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Request-ID': request_id}
+        )
+
+    with metrics.request_context('/api', request_id) as timer:
+        solution = sc.create_solution(query)
+    response = jsonify(solution)
+    response.headers['X-Request-ID'] = timer.request_id
+    if SERVER_TIMING or request.args.get('timing') == 'true':
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
+@app.get('/warmup')
+def warmup():
+    # for scheduled pings that keep an instance warm, loads whatever is not loaded yet
+    return jsonify(cold_start.warm_up())
+
+
+@app.get('/metrics')
+def metrics_endpoint():
+    # prometheus scrape target, values are per worker process
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def _sse_events(sc, query, request_id):
+    # headers are gone before the first span, timings of streamed answers are logged only
+    with metrics.request_context('/api', request_id) as timer:
+        try:
+            for event, data in sc.stream_solution(query):
+                yield format_sse(event, data)
+        except Exception as e: # headers are already sent, report the failure in-band
+            timer.status = 'error'
+            print(f'ERROR streaming solution: {e}')
+            yield format_sse('error', dict(error = 'internal server error'))
 
 
 if __name__ ==  '__main__':
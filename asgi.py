@@ -0,0 +1,140 @@
+import os
+import json
+import uuid
+import asyncio
+import traceback
+from urllib.parse import parse_qs
+
+from solution_creator import SolutionCreator, format_sse
+import metrics
+import cold_start
+import clients
+
+
+# asgi entry point for the async pipeline, a single worker process keeps many slow
+# upstream calls in flight without a thread per request
+# run with:  uvicorn asgi:app   or   gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+
+# same permissive cors policy that flask-cors applies to app.py
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-expose-headers', b'X-Request-ID, Server-Timing'),
+]
+
+# per-stage timings in a Server-Timing header on every response, otherwise only with ?timing=true
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+
+    if method == 'OPTIONS': # cors preflight
+        await _send(send, 204, b'', [])
+        return
+
+    if path == '/metrics' and method == 'GET': # prometheus scrape target
+        await _send(send, 200, metrics.render().encode('utf-8'), [(b'content-type', metrics.CONTENT_TYPE.encode())])
+        return
+    if path != '/api':
+        await _send_json(send, 404, dict(error = 'not found'))
+        return
+    if method != 'POST':
+        await _send_json(send, 405, dict(error = 'method not allowed'))
+        return
+
+    try:
+        query = json.loads(await _read_body(receive) or b'{}')
+    except ValueError:
+        await _send_json(send, 400, dict(error = 'request body must be json'))
+        return
+
+    request_headers = dict(scope.get('headers', []))
+    request_id = request_headers.get(b'x-request-id', b'').decode() or uuid.uuid4().hex[:16]
+    query_params = parse_qs(scope.get('query_string', b'').decode())
+
+    # opt-in streaming: links first, then answer tokens as server-sent events
+    if query_params.get('stream') == ['true'] or query.get('stream'):
+        await _stream_solution(send, query, request_id)
+        return
+
+    with metrics.request_context('/api', request_id) as timer:
+        try:
+            solution = await SolutionCreator().acreate_solution(query)
+        except Exception:
+            timer.status = 'error'
+            traceback.print_exc()
+            solution = None
+    headers = [(b'x-request-id', request_id.encode())]
+    if SERVER_TIMING or query_params.get('timing') == ['true']:
+        headers.append((b'server-timing', timer.server_timing().encode()))
+    if solution is None:
+        await _send_json(send, 500, dict(error = 'internal server error'), headers)
+        return
+    await _send_json(send, 200, solution, headers)
+
+
+async def _stream_solution(send, query, request_id):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'x-request-id', request_id.encode()),
+        ] + CORS_HEADERS,
+    })
+    # headers are gone before the first span, timings of streamed answers are logged only
+    with metrics.request_context('/api', request_id) as timer:
+        try:
+            async for event, data in SolutionCreator().astream_solution(query):
+                await send({'type': 'http.response.body', 'body': format_sse(event, data).encode('utf-8'), 'more_body': True})
+        except Exception: # headers are already sent, report the failure in-band
+            timer.status = 'error'
+            traceback.print_exc()
+            await send({'type': 'http.response.body', 'body': format_sse('error', dict(error = 'internal server error')).encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # load the resident indexes and clients before the first request arrives
+            await asyncio.to_thread(cold_start.warm_up)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await clients.aclose_async_http_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _send_json(send, status, payload, headers=()):
+    await _send(send, status, json.dumps(payload).encode('utf-8'), [(b'content-type', b'application/json'), *headers])
+
+
+async def _send(send, status, body, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers + CORS_HEADERS + [(b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
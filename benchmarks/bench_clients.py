@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root
+
+import requests
+from google import genai
+from google.genai import types
+
+import clients
+from benchmarks.stub_servers import embeddings_stub, gemini_stub
+
+
+# latency saved per request by pooled upstream clients, measured against local stubs
+# usage: python benchmarks/bench_clients.py --requests 200
+
+
+def timed(call, n_requests):
+    latencies = []
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name, fresh, pooled):
+    fresh_ms, pooled_ms = statistics.mean(fresh), statistics.mean(pooled)
+    print(
+        f'{name:<12} fresh client: {fresh_ms:8.2f} ms   pooled client: {pooled_ms:8.2f} ms   '
+        f'saved: {fresh_ms - pooled_ms:8.2f} ms/request'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fresh vs pooled upstream clients against local stubs')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--no-tls', action='store_true', help='plain http, skips the tls handshake cost')
+    args = parser.parse_args()
+
+    tls = not args.no_tls and shutil.which('openssl') is not None
+    with embeddings_stub(latency=0, tls=tls) as embed_stub, gemini_stub(latency=0, answer_words=20, tls=tls) as gem_stub:
+        # trust the stub certificates in both requests and httpx (used by google-genai)
+        if tls:
+            with open(embed_stub.cert_path) as a, open(gem_stub.cert_path) as b, open(f'{embed_stub.cert_path}.bundle', 'w') as bundle:
+                bundle.write(a.read() + b.read())
+            os.environ['REQUESTS_CA_BUNDLE'] = os.environ['SSL_CERT_FILE'] = f'{embed_stub.cert_path}.bundle'
+
+        embed_url = f'{embed_stub.url}/openai/v1/embeddings'
+        payload = dict(model = 'text-embedding-3-small', input = 'how do i submit ga5?')
+
+        # embeddings: bare requests.post opens a new connection every time
+        fresh = timed(lambda: requests.post(embed_url, json=payload, timeout=30).json(), args.requests)
+        pooled = timed(lambda: clients.get_http_session().post(embed_url, json=payload, timeout=30).json(), args.requests)
+        report('embeddings', fresh, pooled)
+
+        # gemini: a new genai.Client per call vs the shared per-worker client
+        os.environ['GEMINI_BASE_URL'] = gem_stub.url
+        os.environ.setdefault('GOOGLE_API_KEY', 'stub')
+        def fresh_gemini():
+            client = genai.Client(api_key='stub', http_options=types.HttpOptions(base_url=gem_stub.url))
+            client.models.generate_content(model='gemini-2.0-flash', contents=['hello'])
+        def pooled_gemini():
+            clients.get_genai_client().models.generate_content(model='gemini-2.0-flash', contents=['hello'])
+        fresh = timed(fresh_gemini, args.requests)
+        pooled = timed(pooled_gemini, args.requests)
+        report('gemini', fresh, pooled)
+
+    print(f'requests per case: {args.requests}  tls: {tls}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root
+
+from discourse_scraper import DiscourseScraper
+from benchmarks.stub_servers import discourse_stub
+
+
+# forum crawl throughput and incremental sync cost against a local fake discourse server
+# usage: python benchmarks/bench_crawler.py --topics 300 --latency 0.05 --error-rate 0.02
+
+
+def crawl(stub, concurrent, concurrency, output_path):
+    scraper = DiscourseScraper(
+        category_id=34, base_url=stub.url, concurrency=concurrency,
+        requests_per_minute=600_000, max_retries=8 # no client side limit, measure the crawl itself
+    )
+    requests_before = stub.stats['requests']
+    start = time.perf_counter()
+    posts = list(scraper.scrape_forum('2025-01-01', '2025-12-31', concurrent=concurrent, output_path=output_path))
+    return posts, time.perf_counter() - start, stub.stats['requests'] - requests_before
+
+
+def sync(stub, concurrency, workdir):
+    scraper = DiscourseScraper(category_id=34, base_url=stub.url, concurrency=concurrency, requests_per_minute=600_000, max_retries=8)
+    requests_before = stub.stats['requests']
+    start = time.perf_counter()
+    posts = list(scraper.sync_forum(
+        '2025-01-01', '2025-12-31',
+        posts_path=os.path.join(workdir, 'synced_posts.jsonl'), state_path=os.path.join(workdir, 'sync_state.json')
+    ))
+    return posts, time.perf_counter() - start, stub.stats['requests'] - requests_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sequential vs concurrent crawl of a local fake discourse forum')
+    parser.add_argument('--topics', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--active-topics', type=int, default=5) # topics with new replies before the refresh
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    output_path = os.path.join(workdir, 'posts.jsonl')
+    with discourse_stub(n_topics=args.topics, latency=args.latency, error_rate=args.error_rate) as stub:
+        sequential, sequential_seconds, sequential_requests = crawl(stub, False, args.concurrency, output_path)
+        concurrent, concurrent_seconds, concurrent_requests = crawl(stub, True, args.concurrency, output_path)
+        assert len(concurrent) == stub.n_posts, 'concurrent crawl missed posts'
+        assert concurrent == sequential, 'concurrent crawl differs from the sequential one'
+
+        # first sync is a full crawl, the refresh after some new replies only fetches what moved
+        sync(stub, args.concurrency, workdir)
+        stub.add_activity(n_topics=args.active_topics, n_posts=3)
+        refreshed, refresh_seconds, refresh_requests = sync(stub, args.concurrency, workdir)
+        assert len(refreshed) == stub.n_posts, 'incremental sync missed posts'
+        _, idle_seconds, idle_requests = sync(stub, args.concurrency, workdir)
+
+    print(f'topics: {args.topics}  posts: {stub.n_posts}  stub latency: {args.latency}s  stub 429 rate: {args.error_rate}')
+    print(f'sequential: {args.topics / sequential_seconds:8.1f} topics/s  ({sequential_requests} requests, {sequential_seconds:.2f}s)')
+    print(f'concurrent: {args.topics / concurrent_seconds:8.1f} topics/s  ({concurrent_requests} requests, {concurrent_seconds:.2f}s)')
+    print(f'sync after new replies in {args.active_topics} topics: {refresh_requests} requests, {refresh_seconds:.2f}s')
+    print(f'sync with no new activity: {idle_requests} requests, {idle_seconds:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
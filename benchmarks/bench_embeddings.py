@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root
+
+import numpy as np
+
+from embed_gen import Embedder
+from benchmarks.stub_servers import embeddings_stub
+
+
+# embedding throughput against a local stub of the embeddings endpoint
+# usage: python benchmarks/bench_embeddings.py --chunks 2000 --latency 0.2 --error-rate 0.02
+
+
+def synthetic_chunks(n_chunks, seed=0):
+    rng = np.random.default_rng(seed)
+    words = ['python', 'docker', 'api', 'assignment', 'deadline', 'error', 'score', 'llm', 'git', 'excel']
+    return [
+        f'<original_post|{100000 + i}/1>\n' + ' '.join(rng.choice(words, int(rng.integers(50, 400))))
+        for i in range(n_chunks)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bulk vs per-chunk embedding throughput against a local stub')
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--sequential-sample', type=int, default=50) # per-chunk path is slow, time a sample
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--batch-items', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+
+    with embeddings_stub(latency=args.latency, error_rate=args.error_rate) as stub:
+        url = f'{stub.url}/openai/v1/embeddings'
+        os.environ.setdefault('AIPIPE_KEY', 'stub')
+        workdir = tempfile.mkdtemp()
+        os.chdir(workdir) # create_chunk_embeddings writes embed_data.npz to the working directory
+
+        # one request per chunk, without the fixed 1s sleep so only the request cost is compared
+        # the per-chunk path has no retries, so errors are switched off while it runs
+        stub.error_rate = 0.0
+        embedder = Embedder(url=url)
+        sample = chunks[:args.sequential_sample]
+        start = time.perf_counter()
+        for chunk in sample:
+            embedder.embed_content(chunk, use_cache=False)
+        sequential_rate = len(sample) / (time.perf_counter() - start)
+        stub.error_rate = args.error_rate
+
+        # bulk mode: packed list inputs, concurrent requests, retries on 429
+        embedder = Embedder(url=url, max_batch_items=args.batch_items, concurrency=args.concurrency, max_retries=8)
+        requests_before = stub.stats['requests']
+        start = time.perf_counter()
+        embedder.create_chunk_embeddings(chunks, bulk=True)
+        bulk_seconds = time.perf_counter() - start
+        bulk_requests = stub.stats['requests'] - requests_before
+
+        saved = np.load(f'{workdir}/embed_data.npz')['embeddings']
+        assert saved.shape[0] == len(chunks), 'bulk run did not embed every chunk'
+
+    print(f'chunks: {len(chunks)}  stub latency: {args.latency}s  stub 429 rate: {args.error_rate}')
+    print(f'per-chunk: {sequential_rate:10.1f} chunks/s (excluding the 1s sleep)')
+    print(f'bulk:      {len(chunks) / bulk_seconds:10.1f} chunks/s  ({bulk_requests} requests, {bulk_seconds:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT) # repo root
+
+import numpy as np
+
+from benchmarks.stub_servers import discourse_stub, embeddings_stub, gemini_stub, image_stub
+
+
+# offline benchmark suite for the pipeline stages over synthetic data and local stub servers
+#   scrape      crawl of a fake discourse forum                       (posts/s, latency per request)
+#   chunk       ChunkCreator over a synthetic forum, images via stubs (posts/s, latency per topic)
+#   embed       bulk Embedder against the embeddings stub             (chunks/s, latency per request)
+#   search-*    _get_most_similar_indices over a synthetic matrix     (queries/s, latency per query)
+# every stage runs in its own process, so peak rss is the stage's own and singletons start cold
+# results are written as json, one file per commit, and two files can be compared
+# usage: python benchmarks/bench_suite.py --posts 100000 --chunks 1000000 --dims 256
+#        python benchmarks/bench_suite.py --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+
+STAGES = ('scrape', 'chunk', 'embed', 'search-exact', 'search-ivf', 'search-quantized', 'search-hybrid')
+SEARCH_SETTINGS = {
+    'search-exact': dict(SEARCH_ENGINE = 'exact', RETRIEVAL = 'dense'),
+    'search-ivf': dict(SEARCH_ENGINE = 'ivf', RETRIEVAL = 'dense'),
+    'search-quantized': dict(SEARCH_ENGINE = 'quantized', RETRIEVAL = 'dense'),
+    'search-hybrid': dict(SEARCH_ENGINE = 'exact', RETRIEVAL = 'hybrid')
+}
+VOCABULARY = 20_000 # distinct synthetic terms, drawn with a zipf distribution like real text
+
+
+
+def synthetic_text(rng, n_words):
+    # a few recognisable course words over a long tail of rare terms
+    common = ['docker', 'ga5', 'deadline', 'llm', 'api', 'error', 'score', 'git', 'excel', 'python']
+    terms = np.minimum(rng.zipf(1.3, n_words), VOCABULARY)
+    return ' '.join(common[term - 1] if term <= len(common) else f'term{term}' for term in terms)
+
+
+def synthetic_chunks(n_chunks, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        f'<original_post|{100000 + i}/1>\n' + synthetic_text(rng, int(rng.integers(30, 200)))
+        for i in range(n_chunks)
+    ]
+
+
+def synthetic_posts(n_posts, image_url, image_rate=0.02, posts_per_topic=30, seed=0):
+    # topics of scraped posts in the PostStore format, with replies, accepted answers and images
+    rng = np.random.default_rng(seed)
+    topic_id = 100000
+    while n_posts > 0:
+        n_topic_posts = min(int(rng.integers(1, posts_per_topic + 1)), n_posts)
+        n_posts -= n_topic_posts
+        accepted = int(rng.integers(2, n_topic_posts + 1)) if n_topic_posts > 1 and rng.random() < 0.3 else None
+        posts = list()
+        for post_number in range(1, n_topic_posts + 1):
+            with_image = rng.random() < image_rate
+            posts.append(dict(
+                post_url = f'https://forum.example/t/topic-{topic_id}/{topic_id}/{post_number}',
+                topic_title = f'topic {topic_id}',
+                markdown = synthetic_text(rng, int(rng.integers(20, 300))),
+                user_title = None if rng.random() < 0.9 else 'Course Faculty',
+                post_number = post_number,
+                reply_count = 0,
+                reply_to_post_number = int(rng.integers(1, post_number)) if post_number > 1 and rng.random() < 0.6 else None,
+                accepted_answer = post_number == accepted,
+                image_urls = [f'{image_url}/uploads/{topic_id}-{post_number}.png'] if with_image else []
+            ))
+        for post in posts:
+            post['reply_count'] = sum(1 for other in posts if other['reply_to_post_number'] == post['post_number'])
+        yield posts
+        topic_id += 1
+
+
+def synthetic_embeddings(store_dir, n_vectors, dims, n_clusters=256, block_size=65536, seed=0):
+    # clustered unit vectors written block by block into an embed_store, so 1M x 1536 never sits in memory
+    from vector_index import VectorIndex
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dims)).astype(np.float32)
+    os.makedirs(store_dir, exist_ok=True)
+    embeddings = np.lib.format.open_memmap(f'{store_dir}/embeddings.npy', mode='w+', dtype=np.float32, shape=(n_vectors, dims))
+    for start in range(0, n_vectors, block_size):
+        n_block = min(block_size, n_vectors - start)
+        block = centers[rng.integers(0, n_clusters, n_block)] + rng.standard_normal((n_block, dims)).astype(np.float32)
+        embeddings[start:start + n_block] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    embeddings.flush()
+    del embeddings
+    with open(f'{store_dir}/sources.json', 'w', encoding='utf-8') as f:
+        json.dump([f'https://forum.example/t/{100000 + i}/1' for i in range(n_vectors)], f)
+    return VectorIndex.from_store(store_dir)
+
+
+
+def measure(stage, items, seconds, latencies, unit, **extra):
+    # stages without per-call samples report null percentiles, json has no nan
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    percentiles, mean = [None] * 3, None
+    if len(latencies_ms):
+        percentiles, mean = np.percentile(latencies_ms, [50, 95, 99]).round(3).tolist(), round(float(latencies_ms.mean()), 3)
+    return dict(
+        stage = stage,
+        items = items,
+        unit = unit,
+        seconds = round(seconds, 4),
+        throughput = round(items / seconds, 2) if seconds else None, # items per second
+        latency_ms = dict(
+            count = len(latencies_ms),
+            p50 = percentiles[0],
+            p95 = percentiles[1],
+            p99 = percentiles[2],
+            mean = mean
+        ),
+        peak_rss_mb = peak_rss_mb(),
+        **extra
+    )
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def timed(function, latencies):
+    # wraps a bound method and records the duration of every call, thread safe
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+
+def run_scrape(args, workdir):
+    from discourse_scraper import DiscourseScraper
+
+    # the stub draws between 1 and 30 posts per topic
+    n_topics = max(1, args.posts // 15)
+    latencies = list()
+    with discourse_stub(n_topics=n_topics, latency=args.latency, error_rate=args.error_rate) as stub:
+        scraper = DiscourseScraper(
+            category_id=34, base_url=stub.url, concurrency=args.concurrency,
+            requests_per_minute=600_000, max_retries=8 # no client side limit, measure the crawl itself
+        )
+        scraper._get = timed(scraper._get, latencies)
+        start = time.perf_counter()
+        post_store = scraper.scrape_forum('2025-01-01', '2025-12-31', concurrent=True, output_path=f'{workdir}/posts.jsonl')
+        seconds = time.perf_counter() - start
+        n_posts = sum(1 for _ in post_store)
+        assert n_posts == stub.n_posts, 'crawl missed posts'
+    return measure('scrape', n_posts, seconds, latencies, 'posts', topics=n_topics, requests=len(latencies))
+
+
+def run_chunk(args, workdir):
+    from post_store import PostStore
+    from chunk_creator import ChunkCreator
+    from image_describer import ImageDescriber
+
+    with image_stub(latency=args.latency) as images, gemini_stub(latency=args.latency, answer_words=60) as gemini:
+        os.environ['GEMINI_BASE_URL'] = gemini.url
+        os.environ.setdefault('GOOGLE_API_KEY', 'stub')
+
+        post_store = PostStore(f'{workdir}/posts.jsonl')
+        post_store.clear()
+        for topic_posts in synthetic_posts(args.posts, images.url):
+            post_store.append(topic_posts)
+
+        # ChunkCreator writes raw_chunks.md and the image cache relative to the working directory
+        os.chdir(workdir)
+        os.makedirs('data/markdowns/course_content', exist_ok=True)
+        chunk_creator = ChunkCreator()
+        chunk_creator.image_describer = ImageDescriber(
+            cache_dir=f'{workdir}/image_cache', concurrency=args.concurrency, requests_per_minute=600_000
+        )
+
+        # time spent on each topic is the gap between handing it out and asking for the next one
+        latencies, counts = list(), dict(posts = 0, topics = 0)
+        def timed_topics():
+            for topic_posts in post_store.iter_topics():
+                counts['posts'] += len(topic_posts)
+                counts['topics'] += 1
+                start = time.perf_counter()
+                yield topic_posts
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        chunks = chunk_creator.start_chunk_creation_by_topic(timed_topics(), 'data/markdowns/course_content')
+        seconds = time.perf_counter() - start
+    return measure(
+        'chunk', counts['posts'], seconds, latencies, 'posts',
+        topics=counts['topics'], chunks=len(chunks), gemini_requests=gemini.stats['requests']
+    )
+
+
+def run_embed(args, workdir):
+    from embed_gen import Embedder
+
+    chunks = synthetic_chunks(args.chunks)
+    latencies = list()
+    with embeddings_stub(latency=args.latency, error_rate=args.error_rate, dimensions=args.dims) as stub:
+        os.environ.setdefault('AIPIPE_KEY', 'stub')
+        os.chdir(workdir) # create_chunk_embeddings writes embed_data.npz to the working directory
+        embedder = Embedder(
+            url=f'{stub.url}/openai/v1/embeddings', concurrency=args.concurrency,
+            requests_per_minute=600_000, tokens_per_minute=10**12, max_retries=8
+        )
+        embedder._post_with_retry = timed(embedder._post_with_retry, latencies)
+        start = time.perf_counter()
+        embedder.create_chunk_embeddings(chunks, bulk=True)
+        seconds = time.perf_counter() - start
+        n_saved = np.load(f'{workdir}/embed_data.npz')['embeddings'].shape[0]
+        assert n_saved == len(chunks), 'bulk run did not embed every chunk'
+    return measure('embed', len(chunks), seconds, latencies, 'chunks', requests=stub.stats['requests'])
+
+
+def run_search_build(args, workdir):
+    # search data shared by the search stages, written once: embed_store, chunk_store and every index file
+    from chunk_store import ChunkStore
+    from ivf_index import IVFIndex
+    from quantized_index import QuantizedIndex
+    from bm25_index import BM25Index
+
+    os.chdir(workdir)
+    build_seconds = dict()
+    start = time.perf_counter()
+    vector_index = synthetic_embeddings('embed_store', args.chunks, args.dims)
+    chunks = synthetic_chunks(args.chunks)
+    ChunkStore.from_chunks(chunks).write('chunk_store')
+    build_seconds['data'] = time.perf_counter() - start
+
+    for name, build in [
+        ('ivf', lambda: IVFIndex.build(vector_index).save('ivf_index.npz')),
+        ('quantized', lambda: QuantizedIndex.build(vector_index).save('quantized_index.npz')),
+        ('bm25', lambda: BM25Index.build(chunks).save('bm25_index.npz'))
+    ]:
+        start = time.perf_counter()
+        build()
+        build_seconds[name] = time.perf_counter() - start
+
+    return measure(
+        'search-build', args.chunks, sum(build_seconds.values()), list(), 'chunks',
+        build_seconds={name: round(seconds, 3) for name, seconds in build_seconds.items()}
+    )
+
+
+def run_search(args, workdir, stage):
+    os.environ.update(SEARCH_SETTINGS[stage])
+    os.chdir(workdir)
+    from solution_creator import SolutionCreator
+    from chunk_store import get_chunk_store
+    from vector_index import get_vector_index
+
+    # queries are noisy copies of random rows, their text a few words of the same chunk
+    rng = np.random.default_rng(1)
+    rows = rng.integers(0, args.chunks, args.queries)
+    embeddings = get_vector_index().embeddings
+    query_vecs = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    query_vecs += rng.standard_normal(query_vecs.shape).astype(np.float32) * 0.02
+    query_texts = [' '.join(get_chunk_store().get(int(row)).split('\n')[1].split()[:8]) for row in np.sort(rows)]
+
+    solution_creator = SolutionCreator()
+    start = time.perf_counter()
+    solution_creator._get_most_similar_indices(query_vecs[0], query_texts[0]) # loads the engine and indexes
+    load_seconds = time.perf_counter() - start
+
+    latencies = list()
+    search = timed(solution_creator._get_most_similar_indices, latencies)
+    start = time.perf_counter()
+    for query_vec, query_text in zip(query_vecs, query_texts):
+        search(query_vec, query_text)
+    seconds = time.perf_counter() - start
+    return measure(stage, args.queries, seconds, latencies, 'queries', load_seconds=round(load_seconds, 3))
+
+
+
+def run_stage(args):
+    # child process side, the result goes to a json file so stage output can be thrown away
+    workdir = os.path.join(args.workdir, args.stage.split('-')[0]) # search stages share their data
+    os.makedirs(workdir, exist_ok=True)
+    if args.stage == 'search-build':
+        result = run_search_build(args, workdir)
+    elif args.stage.startswith('search-'):
+        result = run_search(args, workdir, args.stage)
+    else:
+        result = dict(scrape = run_scrape, chunk = run_chunk, embed = run_embed)[args.stage](args, workdir)
+    with open(args.result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def spawn_stage(args, stage, workdir):
+    result_path = os.path.join(workdir, f'{stage}.result.json')
+    command = [sys.executable, os.path.abspath(__file__), '--stage', stage, '--workdir', workdir, '--result-path', result_path]
+    for name in ('posts', 'chunks', 'dims', 'queries', 'latency', 'error_rate', 'concurrency'):
+        command += [f'--{name.replace('_', '-')}', str(getattr(args, name))]
+    with open(os.path.join(workdir, f'{stage}.log'), 'w', encoding='utf-8') as log:
+        completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+    if completed.returncode != 0:
+        print(f'ERROR stage {stage} failed, see {log.name}')
+        return None
+    with open(result_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results):
+    def cell(value):
+        return f'{'-':>10}' if value is None else f'{value:>10.2f}'
+
+    print(f'{'stage':<18}{'items':>10}{'throughput':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak rss mb':>13}')
+    for name, result in results['stages'].items():
+        latency = result['latency_ms']
+        print(
+            f'{name:<18}{result['items']:>10}{result['throughput'] or 0:>10.1f} {result['unit'][:3]}/s'
+            f'{cell(latency['p50'])}{cell(latency['p95'])}{cell(latency['p99'])}{result['peak_rss_mb']:>13.1f}'
+        )
+
+
+def compare(base_path, head_path):
+    # relative change per stage, throughput up and latency or memory down is better
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(head_path, 'r', encoding='utf-8') as f:
+        head = json.load(f)
+    print(f'{base['commit']} -> {head['commit']}')
+    if base['config'] != head['config']:
+        print(f'WARNING runs used different settings: {base['config']} vs {head['config']}')
+    print(f'{'stage':<18}{'throughput':>12}{'p50':>10}{'p95':>10}{'p99':>10}{'peak rss':>10}')
+
+    def change(old, new):
+        if not old or new is None:
+            return f'{'n/a':>10}'
+        return f'{(new - old) / old * 100:>+9.1f}%'
+
+    for name, result in head['stages'].items():
+        if name not in base['stages']:
+            continue
+        old = base['stages'][name]
+        print(
+            f'{name:<18}{change(old['throughput'], result['throughput']):>12}'
+            + ''.join(change(old['latency_ms'][p], result['latency_ms'][p]) for p in ('p50', 'p95', 'p99'))
+            + change(old['peak_rss_mb'], result['peak_rss_mb'])
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmarks of the scrape, chunk, embed and search stages')
+    parser.add_argument('--posts', type=int, default=10_000, help='synthetic forum size for scrape and chunk')
+    parser.add_argument('--chunks', type=int, default=10_000, help='synthetic chunks for embed and search')
+    parser.add_argument('--dims', type=int, default=1536, help='embedding dimensions')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added by every stub response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of stub responses that are 429s')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'comma separated subset of {','.join(STAGES)}')
+    parser.add_argument('--output', help='result json, defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two result files and exit')
+    parser.add_argument('--stage', help=argparse.SUPPRESS) # internal, runs one stage in this process
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.stage:
+        return run_stage(args)
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f'unknown stages {unknown}, expected a subset of {STAGES}')
+    if any(stage.startswith('search-') for stage in stages):
+        stages.insert(next(i for i, stage in enumerate(stages) if stage.startswith('search-')), 'search-build')
+
+    workdir = tempfile.mkdtemp(prefix='bench_suite_')
+    results = dict(
+        commit = git_commit(),
+        created_at = datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        python = platform.python_version(),
+        platform = platform.platform(),
+        cpus = os.cpu_count(),
+        config = {name: getattr(args, name) for name in ('posts', 'chunks', 'dims', 'queries', 'latency', 'error_rate', 'concurrency')},
+        stages = dict()
+    )
+    for stage in stages:
+        print(f'running {stage}...') # report progress
+        result = spawn_stage(args, stage, workdir)
+        if result is not None:
+            results['stages'][stage] = result
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'{results['commit']}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f'results written to {output}  (stage logs in {workdir})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import os
+import ssl
+import json
+import base64
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+# local stand-ins for the upstream APIs so throughput can be measured offline
+# every stub runs a ThreadingHTTPServer on a free localhost port in a daemon thread
+
+
+
+class StubServer:
+
+    def __init__(self, routes, latency=0.0, error_rate=0.0, seed=0, tls=False):
+        # routes: list of (method, path prefix, handler(request_handler, body) -> (status, headers, payload))
+        self.routes = routes
+        self.latency = latency          # seconds added to every response
+        self.error_rate = error_rate    # fraction of requests answered with a 429
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = dict(requests = 0, errors = 0)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+        # optional https with a throwaway self-signed certificate, so handshake costs show up
+        self.cert_path = None
+        if tls:
+            self.cert_path, key_path = self_signed_certificate()
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.cert_path, key_path)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        scheme = 'https' if self.cert_path else 'http'
+        return f'{scheme}://{host}:{port}'
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, like the real upstreams
+            disable_nagle_algorithm = True # headers and body go out in separate writes
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def log_message(self, *args):
+                pass # keep benchmark output clean
+
+            def _dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+
+                with stub.lock:
+                    stub.stats['requests'] += 1
+                    fail = stub.random.random() < stub.error_rate
+                    if fail:
+                        stub.stats['errors'] += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if fail:
+                    status, headers, payload = 429, {'Retry-After': '0'}, {'error': 'rate limited'}
+                else:
+                    route = next((r for r in stub.routes if r[0] == method and self.path.startswith(r[1])), None)
+                    if route is None:
+                        status, headers, payload = 404, {}, {'error': 'not found'}
+                    else:
+                        status, headers, payload = route[2](self, body)
+                self._respond(status, headers, payload)
+
+            def _respond(self, status, headers, payload):
+                if isinstance(payload, (bytes, str)):
+                    data = payload.encode('utf-8') if isinstance(payload, str) else payload
+                    content_type = headers.pop('Content-Type', 'text/plain')
+                else:
+                    data = json.dumps(payload).encode('utf-8')
+                    content_type = 'application/json'
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+
+def fake_embedding(text, dimensions=1536):
+    # deterministic pseudo-random unit vector for a piece of text
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def embeddings_stub(latency=0.05, error_rate=0.0, dimensions=1536, max_inputs=2048, tls=False):
+    # mimics the aipipe/openai embeddings endpoint, single string or list input
+    def embeddings(handler, body):
+        request = json.loads(body)
+        inputs = request['input'] if isinstance(request['input'], list) else [request['input']]
+        if len(inputs) > max_inputs:
+            return 400, {}, {'error': f'at most {max_inputs} inputs per request'}
+        data = [
+            dict(object = 'embedding', index = index, embedding = fake_embedding(text, dimensions))
+            for index, text in enumerate(inputs)
+        ]
+        tokens = sum(len(text) // 4 + 1 for text in inputs)
+        return 200, {}, dict(object = 'list', data = data, model = request['model'], usage = dict(prompt_tokens = tokens, total_tokens = tokens))
+
+    return StubServer([('POST', '/openai/v1/embeddings', embeddings)], latency=latency, error_rate=error_rate, tls=tls)
+
+
+def gemini_stub(latency=0.3, error_rate=0.0, answer_words=200, tls=False):
+    # mimics the gemini generateContent and streamGenerateContent (sse) endpoints with a fixed size answer
+    def response(text, prompt_tokens, answer_tokens):
+        return dict(
+            candidates = [dict(content = dict(parts = [dict(text = text)], role = 'model'), finishReason = 'STOP', index = 0)],
+            usageMetadata = dict(
+                promptTokenCount = prompt_tokens,
+                candidatesTokenCount = answer_tokens,
+                totalTokenCount = prompt_tokens + answer_tokens
+            )
+        )
+
+    def generate_content(handler, body):
+        request = json.loads(body)
+        prompt = ' '.join(part.get('text', '') for content in request['contents'] for part in content['parts'])
+        prompt_tokens = len(prompt) // 4 + 1
+        words = ['lorem'] * answer_words
+
+        if ':streamGenerateContent' in handler.path:
+            # one event per 10 words, sent in a single body
+            events = [
+                'data: ' + json.dumps(response(' '.join(words[i:i + 10]) + ' ', prompt_tokens, min(i + 10, answer_words))) + '\r\n\r\n'
+                for i in range(0, answer_words, 10)
+            ]
+            return 200, {'Content-Type': 'text/event-stream'}, ''.join(events)
+        return 200, {}, response(' '.join(words), prompt_tokens, answer_words)
+
+    return StubServer([('POST', '/v1beta/models/', generate_content)], latency=latency, error_rate=error_rate, tls=tls)
+
+
+def image_stub(latency=0.05, error_rate=0.0):
+    # serves a tiny png under /uploads/ for every path, stands in for the forum's image uploads
+    png = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+
+    def upload(handler, body):
+        return 200, {'Content-Type': 'image/png'}, png
+
+    return StubServer([('GET', '/uploads/', upload)], latency=latency, error_rate=error_rate)
+
+
+def discourse_stub(n_topics=200, posts_per_topic=30, topics_per_page=30, posts_per_page=20,
+                   start_date='2025-01-01', days=120, latency=0.05, error_rate=0.0, seed=0):
+    # mimics the discourse category listing and topic json endpoints over a synthetic forum,
+    # topics are listed newest activity first and topic pages past the end answer 404
+    rng = random.Random(seed)
+    start = datetime.fromisoformat(start_date)
+    topics, topic_posts = list(), dict()
+    for topic_id in range(1000, 1000 + n_topics):
+        slug = f'topic-{topic_id}'
+        created = start + timedelta(hours=rng.uniform(0, days * 24))
+        n_posts = rng.randint(1, posts_per_topic)
+        accepted = rng.randint(2, n_posts) if n_posts > 1 and rng.random() < 0.3 else None
+        posts, posted_at = list(), created
+        for post_number in range(1, n_posts + 1):
+            posted_at += timedelta(minutes=rng.uniform(1, 600))
+            posts.append(dict(
+                post_url = f'/t/{slug}/{topic_id}/{post_number}',
+                topic_slug = slug,
+                raw = f'post {post_number} of topic {topic_id} ' + ' '.join(rng.choice(['docker', 'ga5', 'llm', 'deadline']) for _ in range(30)),
+                cooked = '<p>post</p>' if rng.random() > 0.1 else '<a href="https://example.com/upload/image.png">image</a>',
+                user_title = rng.choice([None, None, 'Course Faculty']),
+                post_number = post_number,
+                reply_count = 0,
+                reply_to_post_number = rng.randint(1, post_number - 1) if post_number > 1 and rng.random() < 0.6 else None,
+                accepted_answer = post_number == accepted,
+                created_at = posted_at.isoformat() + 'Z',
+                updated_at = posted_at.isoformat() + 'Z'
+            ))
+        for post in posts:
+            post['reply_count'] = sum(1 for other in posts if other['reply_to_post_number'] == post['post_number'])
+        topic_posts[topic_id] = posts
+        topics.append(dict(
+            id = topic_id, slug = slug, created_at = posts[0]['created_at'], last_posted_at = posts[-1]['created_at'],
+            posts_count = len(posts), highest_post_number = len(posts)
+        ))
+    topics.sort(key=lambda topic: topic['last_posted_at'], reverse=True)
+
+    def query_page(path, default):
+        query = parse_qs(urlparse(path).query)
+        return int(query.get('page', [default])[0])
+
+    def category(handler, body):
+        page = query_page(handler.path, 0)
+        page_topics = topics[page * topics_per_page:(page + 1) * topics_per_page]
+        # etag of the listing page, conditional requests get a 304 while nothing changed
+        etag = '"' + hashlib.sha256(json.dumps(page_topics).encode('utf-8')).hexdigest()[:16] + '"'
+        if handler.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag}, dict(topic_list = dict(topics = page_topics))
+
+    def topic(handler, body):
+        topic_id = int(urlparse(handler.path).path.split('/')[2].removesuffix('.json'))
+        page = query_page(handler.path, 1)
+        posts = topic_posts.get(topic_id, [])[(page - 1) * posts_per_page:page * posts_per_page]
+        if not posts:
+            return 404, {}, {'error': 'not found'}
+        return 200, {}, dict(post_stream = dict(posts = posts))
+
+    def add_activity(n_topics=5, n_posts=3):
+        # new replies, posted after everything else, at the end of a few random topics
+        # which bumps them to the top of the listing like on the real forum
+        posted_at = datetime.fromisoformat(topics[0]['last_posted_at'].removesuffix('Z'))
+        for topic in rng.sample(topics, min(n_topics, len(topics))):
+            posts = topic_posts[topic['id']]
+            for _ in range(n_posts):
+                posted_at += timedelta(minutes=5)
+                post_number = posts[-1]['post_number'] + 1
+                posts.append(dict(
+                    posts[-1], post_url = f'/t/{topic['slug']}/{topic['id']}/{post_number}', post_number = post_number,
+                    raw = f'post {post_number} of topic {topic['id']}', reply_count = 0, accepted_answer = False,
+                    reply_to_post_number = 1, created_at = posted_at.isoformat() + 'Z', updated_at = posted_at.isoformat() + 'Z'
+                ))
+                posts[0]['reply_count'] += 1
+            topic.update(last_posted_at = posts[-1]['created_at'], posts_count = len(posts), highest_post_number = len(posts))
+        topics.sort(key=lambda topic: topic['last_posted_at'], reverse=True)
+        stub.n_posts = sum(len(posts) for posts in topic_posts.values())
+
+    stub = StubServer([('GET', '/c/', category), ('GET', '/t/', topic)], latency=latency, error_rate=error_rate, seed=seed)
+    stub.n_posts = sum(len(posts) for posts in topic_posts.values())
+    stub.add_activity = add_activity
+    return stub
+
+
+def self_signed_certificate():
+    # certificate and key for 127.0.0.1, needs the openssl cli
+    if shutil.which('openssl') is None:
+        raise RuntimeError('openssl is required for tls stubs')
+    folder = tempfile.mkdtemp()
+    cert_path, key_path = os.path.join(folder, 'stub.crt'), os.path.join(folder, 'stub.key')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+        '-keyout', key_path, '-out', cert_path
+    ], check=True, capture_output=True)
+    return cert_path, key_path
@@ -0,0 +1,173 @@
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from chunk_store import get_chunk_store
+from vector_index import file_version, get_vector_index
+
+
+
+class BM25Index:
+    # lexical inverted index over the chunk texts, row i is chunk i of the chunk store
+    # postings are flat arrays grouped by term:
+    #   term t owns doc_ids[offsets[t]:offsets[t + 1]] and the matching term_freqs
+    # idf and doc lengths are computed once at build time
+
+    TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+    MAX_TOKEN_LENGTH = 40 # longer runs are hashes, urls or base64, never searched for
+
+    def __init__(self, terms, offsets, doc_ids, term_freqs, idf, doc_lengths, k1=1.2, b=0.75):
+        self.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.term_freqs = np.asarray(term_freqs, dtype=np.float32)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.k1 = k1
+        self.b = b
+        # document length part of the bm25 denominator, fixed per document
+        avg_length = self.doc_lengths.mean() if len(self.doc_lengths) else 1.0
+        self.length_norm = (k1 * (1 - b + b * self.doc_lengths / max(avg_length, 1.0))).astype(np.float32)
+        self.version = None # identifies the file the index came from, set by load
+
+
+    @classmethod
+    def tokenize(cls, text):
+        return [token for token in cls.TOKEN_PATTERN.findall(text.lower()) if len(token) <= cls.MAX_TOKEN_LENGTH]
+
+
+    @classmethod
+    def build(cls, chunks_contents, k1=1.2, b=0.75):
+        vocab = dict()
+        term_ids, doc_ids, term_freqs, doc_lengths = list(), list(), list(), list()
+        for doc_id, chunk_content in enumerate(chunks_contents):
+            counts = Counter(cls.tokenize(chunk_content))
+            doc_lengths.append(sum(counts.values()))
+            for term, term_freq in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_id)
+                term_freqs.append(term_freq)
+
+        # group postings term by term, doc ids stay ascending inside every term
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        doc_freqs = np.bincount(term_ids, minlength=len(vocab))
+        offsets = np.concatenate([[0], np.cumsum(doc_freqs)])
+
+        n_docs = len(doc_lengths)
+        idf = np.log(1 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+        print(f'bm25 index built with {len(vocab)} terms over {n_docs} chunks')
+        return cls(
+            list(vocab), offsets, np.asarray(doc_ids)[order], np.asarray(term_freqs)[order],
+            idf, doc_lengths, k1=k1, b=b
+        )
+
+
+    @classmethod
+    def load(cls, path='bm25_index.npz'):
+        bm25_data = np.load(path)
+        if 'terms_blob' in bm25_data.files:
+            terms = bm25_data['terms_blob'].tobytes().decode('utf-8').split('\n')
+        else: # written before the compact vocabulary
+            terms = bm25_data['terms'].tolist()
+        index = cls(
+            terms, bm25_data['offsets'], bm25_data['doc_ids'], bm25_data['term_freqs'],
+            bm25_data['idf'], bm25_data['doc_lengths'], k1=float(bm25_data['k1']), b=float(bm25_data['b'])
+        )
+        index.version = file_version(path)
+        return index
+
+
+    def save(self, path='bm25_index.npz'):
+        # the vocabulary as one newline separated utf-8 blob, a fixed width unicode array pads
+        # every term to the longest one and was most of the file and of the load time
+        np.savez(
+            path,
+            terms_blob = np.frombuffer('\n'.join(self.vocab).encode('utf-8'), dtype=np.uint8),
+            offsets = self.offsets,
+            doc_ids = self.doc_ids,
+            term_freqs = self.term_freqs,
+            idf = self.idf,
+            doc_lengths = self.doc_lengths,
+            k1 = np.array(self.k1),
+            b = np.array(self.b)
+        )
+
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+
+    def search(self, query_text, k=15):
+        # only the postings of the query terms are touched
+        term_ids = [self.vocab[term] for term in set(self.tokenize(query_text)) if term in self.vocab]
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, term_freqs = self.doc_ids[start:end], self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * term_freqs * (self.k1 + 1) / (term_freqs + self.length_norm[docs])
+
+        # only documents containing a query term are ranked (descending order)
+        matches = np.flatnonzero(scores)
+        k = min(k, len(matches))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        part = matches[np.argpartition(scores[matches], -k)[-k:]]
+        part = part[np.argsort(-scores[part], kind='stable')]
+        return part.astype(np.int64), scores[part]
+
+
+
+def reciprocal_rank_fusion(rankings, k=15, rrf_k=60):
+    # score of a document = sum over the rankings of 1 / (rrf_k + rank), ranks start at 1
+    scores = dict()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[int(doc_id)] = scores.get(int(doc_id), 0.0) + 1.0 / (rrf_k + rank)
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    return np.array(fused, dtype=np.int64)
+
+
+
+# process-wide index, reloaded together with the vector index so rows stay aligned
+# it is only pinned to an index version when the row counts match, an index built from other
+# chunks (e.g. embedding stopped partway and kept the old embeddings) is left out and hybrid
+# retrieval falls back to dense search until the two agree again
+# RETRIEVAL=dense turns the lexical side off
+_index = None
+_index_version = None # vector index version the loaded index is aligned with
+_index_lock = threading.Lock()
+
+
+def get_bm25_index(path='bm25_index.npz'):
+    global _index, _index_version
+    if os.environ.get('RETRIEVAL', 'hybrid') != 'hybrid':
+        return None
+    vector_index = get_vector_index()
+    if _index is None or _index_version != vector_index.version:
+        with _index_lock:
+            if _index is None or _index_version != vector_index.version:
+                _index = _load_bm25_index(path, vector_index, _index)
+                _index_version = vector_index.version if len(_index) == len(vector_index) else None
+    return _index if _index_version == vector_index.version else None
+
+
+def _load_bm25_index(path, vector_index, current):
+    if os.path.exists(path):
+        if current is not None and current.version == file_version(path):
+            return current
+        index = BM25Index.load(path)
+    else: # index not written yet, build it in memory from the chunk store
+        chunk_store = get_chunk_store()
+        if current is not None and current.version == f'chunk_store:{chunk_store.version}':
+            return current
+        index = BM25Index.build(chunk_store.get_many(range(len(chunk_store))))
+        index.version = f'chunk_store:{chunk_store.version}'
+    print(f'bm25 index loaded with {len(index.vocab)} terms')
+    if len(index) != len(vector_index):
+        print(f'ERROR bm25 index has {len(index)} chunks for {len(vector_index)} vectors, using dense search only')
+    return index
@@ -1,27 +1,48 @@
 import os 
-import time
-import filetype
 from typing import List, Dict
-
-import requests
-
-from google import genai
-from google.genai import types 
+from collections import defaultdict
 
 from semantic_text_splitter import MarkdownSplitter, TextSplitter
 
+from image_describer import ImageDescriber
+
 
 
 class ChunkCreator:
 
-    chunked_posts   = list() # will contain all posts present in all of the chunks
-    chunked_replies = list() # will contain all replies present in all of the chunks
-    chunks_contents = list() # will contain contents of all of chunks
+    def __init__(self):
+        self.chunked_posts   = set()  # ids of all posts present in all of the chunks
+        self.chunked_replies = set()  # ids of all replies present in all of the chunks
+        self.chunks_contents = list() # will contain contents of all of chunks
+        self.indexed_posts   = None   # posts list the thread index below was built from
+        self.image_describer = None   # created on first use, opens the image cache
+        self.image_descriptions = dict() # post url -> description of the images in the post
+
 
     def start_chunk_creation(self, posts, course_content_folder):
+        # describe all images up front, concurrently, every post once whichever chunks it ends up in
+        self.image_descriptions = self._get_image_describer().describe_posts(posts)
         self._from_direct_replies(posts)
         self._from_accepted_answers(posts)
         self._from_topic_level_replies(posts)
+        return self._finish_chunk_creation(course_content_folder)
+
+
+    def start_chunk_creation_by_topic(self, topics, course_content_folder):
+        # streaming variant: topics is an iterable of post lists, one per thread (e.g. PostStore.iter_topics()),
+        # so only one thread is in memory at a time and chunks come out topic by topic
+        for topic_posts in topics:
+            # chunked posts and image descriptions only matter within a thread
+            self.chunked_posts, self.chunked_replies = set(), set()
+            self.image_descriptions = self._get_image_describer().describe_posts(topic_posts)
+            self._from_direct_replies(topic_posts)
+            self._from_accepted_answers(topic_posts)
+            self._from_topic_level_replies(topic_posts)
+        self.image_descriptions = dict()
+        return self._finish_chunk_creation(course_content_folder)
+
+
+    def _finish_chunk_creation(self, course_content_folder):
         self._from_course_content_markdowns(course_content_folder)
         with open('data/markdowns/raw_chunks.md', 'w', encoding='utf-8') as f:
             f.write('\n\n<!--divider-->\n\n'.join(self.chunks_contents))
@@ -62,8 +83,8 @@ class ChunkCreator:
             # create complete chunk containing post + replies
             chunk_content = (post_section + replies_section).strip()
             # keep track of all the chunked components
-            self.chunked_posts.append(post)
-            self.chunked_replies.extend(ordered_replies)
+            self.chunked_posts.add(self._post_id(post))
+            self.chunked_replies.update(self._post_id(reply) for reply in ordered_replies)
             self.chunks_contents.append(chunk_content)
             print(f'chunk for {post_prefix} created!')
             
@@ -95,8 +116,8 @@ class ChunkCreator:
             # create complete chunk containing post + accepted reply
             chunk_content = (post_section + reply_section).strip()
             # keep track of all the chunked components
-            self.chunked_posts.append(post)
-            self.chunked_replies.append(accepted_reply)
+            self.chunked_posts.add(self._post_id(post))
+            self.chunked_replies.add(self._post_id(accepted_reply))
             self.chunks_contents.append(chunk_content)
             print(f'chunk for {post_prefix} created!')
 
@@ -107,11 +128,14 @@ class ChunkCreator:
             # skip if not a topic starter 
             if post['post_number'] > 1: continue 
             # skip if post already chunked 
-            if post in self.chunked_posts: continue
+            if self._post_id(post) in self.chunked_posts: continue
             # get all replies to the topic starter 
             replies = self._get_top_level_replies(parent=post, posts=posts)
             # filter out unchunked replies 
-            unchunked_replies = [r for r in replies if r not in self.chunked_posts + self.chunked_replies]
+            unchunked_replies = [
+                r for r in replies 
+                if self._post_id(r) not in self.chunked_posts and self._post_id(r) not in self.chunked_replies
+            ]
 
             # create post section
             post_id = '/'.join(post['post_url'].split('/')[-2:])
@@ -132,8 +156,8 @@ class ChunkCreator:
             # create complete chunk containing post + replies
             chunk_content = (post_section + replies_section).strip()
             # keep track of all the chunked components
-            self.chunked_posts.append(post)
-            self.chunked_replies.extend(unchunked_replies)
+            self.chunked_posts.add(self._post_id(post))
+            self.chunked_replies.update(self._post_id(reply) for reply in unchunked_replies)
             self.chunks_contents.append(chunk_content)
             print(f'chunk for {post_prefix} created!')
 
@@ -195,66 +219,58 @@ class ChunkCreator:
         return adjusted_chunks
 
 
+    def _index_threads(self, posts: List[Dict]) -> None:
+        # built in one pass so the lookups below do not scan every post for every post
+        if self.indexed_posts is posts: return
+        self.topic_posts      = defaultdict(list) # topic -> posts in posting order
+        self.post_replies     = defaultdict(list) # (topic, post number) -> direct replies in posting order
+        self.accepted_answers = dict()            # topic -> first accepted answer
+        for post in posts:
+            topic = post['topic_title']
+            self.topic_posts[topic].append(post)
+            self.post_replies[(topic, post['reply_to_post_number'])].append(post)
+            if post['accepted_answer']:
+                self.accepted_answers.setdefault(topic, post)
+        self.indexed_posts = posts
+
+
     def _get_direct_replies(self, parent: Dict, posts: List[Dict]) -> List[Dict]:
+        self._index_threads(posts)
         return [ # replies to non-topic-starters
-            post for post in posts if post != parent 
-            and post['topic_title'] == parent['topic_title'] 
-            and post['reply_to_post_number'] == parent['post_number']
+            post for post in self.post_replies.get((parent['topic_title'], parent['post_number']), [])
+            if self._post_id(post) != self._post_id(parent)
         ]
 
     def _get_accepted_answer(self, topic_starter: Dict, posts: List[Dict]):
-        return next(( # reply under a topic-start that has been accepted as solution
-            post for post in posts if post['accepted_answer']
-            and post['topic_title'] == topic_starter['topic_title']
-        ), None)
+        self._index_threads(posts)
+        # reply under a topic-start that has been accepted as solution
+        return self.accepted_answers.get(topic_starter['topic_title'])
 
 
     def _get_top_level_replies(self, parent: Dict, posts: List[Dict]):
+        self._index_threads(posts)
         return [ # all of the replies under a topic-starter
-            post for post in posts if post != parent
-            and post['topic_title'] == parent['topic_title']
+            post for post in self.topic_posts.get(parent['topic_title'], [])
+            if self._post_id(post) != self._post_id(parent)
         ]
+
+
+    def _post_id(self, post: Dict) -> str:
+        return '/'.join(post['post_url'].split('/')[-2:]) # topic id / post number
     
     def _describe_image(self, post: Dict) -> str:
-
         if not post['image_urls']:
             return ''
+        # normally filled by the image stage, posts outside it are described (or read from cache) here
+        if post['post_url'] not in self.image_descriptions:
+            self.image_descriptions[post['post_url']] = self._get_image_describer().describe(post)
+        return self.image_descriptions[post['post_url']]
 
-        text_prompt = (
-            'I am building an AI assistant that answers student queries based on forum data. '
-            'I will convert the images posted by users in the forum to their textual descriptions. '
-            'These descriptions will be embedded so that they can be used for RAG.'
-            'When the assistant receives an image in the student query, it will also be converted to '
-            'its textual description and then to its embedding. '
-            'I have attached the image in the prompt. '
-            'You are supposed to give a detailed description of the image, the image might be a '
-            'part of a user question or an answer by a user to some question. Try to find out what '
-            'is being conveyed through the image and any text that the user has provided along with it. '
-            'IMPORTANT NOTE: If you think the image is some sort of a meme, joke, or something not related to studies, '
-            'reply with a simple "no useful information", and nothing else. '
-            'The description must not exceed 4-5 sentences.'
-            f'Text content in the user post: { post['markdown'].strip() if post['markdown'] else 'None' }'
-        )
-
-        client = genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'))
-        image_prompts = []
-        for img_url in post['image_urls']:
-            img_bytes = requests.get(img_url).content
-            mime = filetype.guess_mime(img_bytes)
-            part = types.Part.from_bytes(data=img_bytes, mime_type=mime)  # type: ignore
-            image_prompts.append(part)
-
-        prompt_contents = [text_prompt] + image_prompts
-        try:
-            response = client.models.generate_content(
-                model='gemini-2.0-flash-lite',
-                contents = prompt_contents
-            )
-            time.sleep(0.5)
-            return 'Image Description: \n' + response.text + '\n' # type: ignore
-        except:
-            print( f'Description could not be created for image in {post['post_url']}')
-            return ''
+
+    def _get_image_describer(self) -> ImageDescriber:
+        if self.image_describer is None:
+            self.image_describer = ImageDescriber()
+        return self.image_describer
     
     
 
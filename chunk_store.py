@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+import numpy as np
+
+from vector_index import INDEX_RELOAD_INTERVAL, file_version, get_vector_index
+
+
+
+class ChunkStore:
+    # chunk texts for the serving path, row i belongs to embedding row i
+    #   chunks.bin   all chunk texts concatenated as utf-8
+    #   offsets.npy  int64 byte offsets, chunk i is chunks.bin[offsets[i]:offsets[i + 1]]
+    # both files are memory-mapped, so a lookup is a slice read instead of parsing chunks.json
+    # every write goes to a new version folder and the `current` pointer file names the live one,
+    # so a reader always maps a blob and the offsets written together
+
+    POINTER = 'current'
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self.version = None # identifies the files the chunks came from, set by the loaders
+
+
+    @classmethod
+    def from_chunks(cls, chunks_contents):
+        # in-memory store, used when the files have not been written yet
+        encoded = [chunk_content.encode('utf-8') for chunk_content in chunks_contents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+
+    @classmethod
+    def load(cls, store_dir='chunk_store'):
+        version = cls.current_version(store_dir)
+        # stores written before the version folders keep their files at the top level
+        files_dir = f'{store_dir}/{version}' if os.path.exists(f'{store_dir}/{cls.POINTER}') else store_dir
+        offsets = np.load(f'{files_dir}/offsets.npy', mmap_mode='r')
+        if offsets[-1] == 0: # np.memmap cannot map an empty file
+            store = cls(np.zeros(0, dtype=np.uint8), offsets)
+        else:
+            store = cls(np.memmap(f'{files_dir}/chunks.bin', dtype=np.uint8, mode='r'), offsets)
+        store.version = version
+        return store
+
+
+    @classmethod
+    def current_version(cls, store_dir='chunk_store'):
+        # name of the live version folder, None when no store has been written
+        pointer = f'{store_dir}/{cls.POINTER}'
+        if os.path.exists(pointer):
+            with open(pointer, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        if os.path.exists(f'{store_dir}/offsets.npy'):
+            return file_version(f'{store_dir}/offsets.npy')
+        return None
+
+
+    def write(self, store_dir='chunk_store'):
+        # both files go into a fresh version folder, then the pointer is swapped in one os.replace
+        # so running workers never map a half-written file or a blob with the wrong offsets
+        version = f'v{time.time_ns()}'
+        os.makedirs(f'{store_dir}/{version}')
+        with open(f'{store_dir}/{version}/chunks.bin', 'wb') as f:
+            f.write(self.blob.tobytes())
+        with open(f'{store_dir}/{version}/offsets.npy', 'wb') as f:
+            np.save(f, np.asarray(self.offsets, dtype=np.int64), allow_pickle=False)
+
+        previous = self.current_version(store_dir)
+        with open(f'{store_dir}/{self.POINTER}.tmp', 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(f'{store_dir}/{self.POINTER}.tmp', f'{store_dir}/{self.POINTER}')
+        self.version = version
+
+        # workers may still map the previous version until their next reload, older ones can go
+        for name in os.listdir(store_dir):
+            if name.startswith('v') and name not in (version, previous):
+                shutil.rmtree(f'{store_dir}/{name}', ignore_errors=True)
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def get(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+
+    def get_many(self, indices):
+        return [self.get(int(index)) for index in indices]
+
+
+
+# process-wide store, its own files are re-checked together with the vector index and every
+# INDEX_RELOAD_INTERVAL seconds, and it is only pinned to an index version when the row counts match
+_store = None
+_store_index_version = None # vector index version the loaded store is aligned with
+_store_checked_at = 0.0
+_store_lock = threading.Lock()
+
+
+def get_chunk_store(store_dir='chunk_store', chunks_path='data/json/chunks.json'):
+    global _store, _store_index_version, _store_checked_at
+    index = get_vector_index()
+    if _store_stale(index):
+        with _store_lock:
+            # another thread may have reloaded it while we waited
+            if _store_stale(index):
+                _store_checked_at = time.monotonic()
+                _store = _load_chunk_store(store_dir, chunks_path, index, _store)
+                # a store written before or after the index (setup.py writes them one after the other)
+                # has a different row count, it is not pinned and gets re-checked on the next request
+                _store_index_version = index.version if len(_store) == len(index) else None
+    return _store
+
+
+def _store_stale(index):
+    return (
+        _store is None or _store_index_version != index.version
+        or time.monotonic() - _store_checked_at > INDEX_RELOAD_INTERVAL
+    )
+
+
+def _load_chunk_store(store_dir, chunks_path, index, current):
+    version = ChunkStore.current_version(store_dir)
+    from_chunks = version is None # store not written yet, build it in memory from the raw chunks
+    if from_chunks:
+        version = file_version(chunks_path)
+    if current is not None and current.version == version:
+        return current
+
+    try:
+        if from_chunks:
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                store = ChunkStore.from_chunks(json.load(f))
+            store.version = version
+        else:
+            store = ChunkStore.load(store_dir)
+    except (OSError, ValueError) as e:
+        if current is None:
+            raise
+        print(f'ERROR reloading {store_dir}, keeping the loaded chunk store: {e}')
+        return current
+
+    if len(store) != len(index):
+        print(f'ERROR chunk store has {len(store)} chunks for {len(index)} vectors')
+        if current is not None and len(current) == len(index):
+            return current # the loaded store still matches the index, keep serving it
+    print(f'chunk store loaded with {len(store)} chunks')
+    return store
@@ -0,0 +1,131 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+
+# per-worker upstream clients, created lazily and reused by every request so
+# connections (and their tcp + tls handshakes) are kept alive between calls
+# clients are recreated after a fork, gunicorn workers never share sockets
+# the sdks are imported on first use too, google.genai alone takes about a second to import,
+# which would otherwise be paid by every serverless cold start before the first byte is served
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))  # keep-alive connections per host
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 60))    # seconds
+GEMINI_TIMEOUT = int(os.environ.get('GEMINI_TIMEOUT', 120)) # seconds
+
+
+_lock = threading.Lock()
+_clients = dict() # name -> (pid, client)
+_async_clients = dict() # event loop -> (pid, client, closing task)
+
+
+def _get_or_create(name, factory):
+    pid = os.getpid()
+    entry = _clients.get(name)
+    if entry is None or entry[0] != pid:
+        with _lock:
+            entry = _clients.get(name)
+            if entry is None or entry[0] != pid:
+                entry = (pid, factory())
+                _clients[name] = entry
+    return entry[1]
+
+
+def get_http_session():
+    # pooled requests session for synchronous calls (embeddings, image downloads)
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    return _get_or_create('http_session', create)
+
+
+def request_with_retry(method, url, session=None, max_retries=5, before_attempt=None, on_error=None, **kwargs):
+    # one http call retried with backoff on rate limits, server errors and dropped connections,
+    # any other response (4xx included) is returned for the caller to handle
+    #   before_attempt()  runs before every attempt, e.g. to wait for a rate limiter
+    #   on_error(error)   runs after every failed attempt, e.g. to count upstream errors
+    import requests # kept off the serving import path, like the session itself
+    session = session or get_http_session()
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            if before_attempt is not None:
+                before_attempt()
+            response = session.request(method, url, **kwargs)
+            # only rate limits and server errors are worth retrying
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            error = requests.HTTPError(f'{response.status_code} from {url}', response=response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if on_error is not None:
+            on_error(error)
+
+        if attempt == max_retries:
+            raise error
+
+        # exponential backoff with jitter unless the server said how long to wait
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt + random.random()
+        print(f'request to {url} failed ({error}), retrying in {delay:.1f}s')
+        time.sleep(delay)
+
+
+def get_async_http_client():
+    # httpx clients are bound to the event loop they were first used on, so there is one per loop,
+    # keyed by the loop object itself (an id could be reused by a later loop)
+    loop = asyncio.get_running_loop()
+    pid = os.getpid()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0] != pid:
+        with _lock:
+            entry = _async_clients.get(loop)
+            if entry is None or entry[0] != pid:
+                import httpx
+                # loops that were closed without cancelling their tasks, their clients are garbage collected
+                for closed_loop in [other for other in _async_clients if other.is_closed()]:
+                    del _async_clients[closed_loop]
+                limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+                client = httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT)
+                entry = (pid, client, loop.create_task(_close_with_loop(loop, client)))
+                _async_clients[loop] = entry
+    return entry[1]
+
+
+async def _close_with_loop(loop, client):
+    # waits until the loop shuts down: asyncio.run (and uvicorn) cancel the remaining tasks
+    # before closing the loop, so the keep-alive connections are closed while it still runs
+    try:
+        await loop.create_future()
+    finally:
+        entry = _async_clients.get(loop)
+        if entry is not None and entry[1] is client:
+            del _async_clients[loop]
+        await client.aclose()
+
+
+async def aclose_async_http_client():
+    # closes the running loop's client and its keep-alive connections, called before the loop stops
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None and entry[0] == os.getpid():
+        entry[2].cancel()
+        await entry[1].aclose()
+
+
+def get_genai_client():
+    # one gemini client per worker, its sync and aio interfaces both keep their connections
+    def create():
+        from google import genai
+        from google.genai import types
+        http_options = types.HttpOptions(timeout=GEMINI_TIMEOUT * 1000)
+        if os.environ.get('GEMINI_BASE_URL'): # local stub for offline benchmarks
+            http_options.base_url = os.environ['GEMINI_BASE_URL']
+        return genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'), http_options=http_options)
+    return _get_or_create('genai_client', create)
@@ -0,0 +1,60 @@
+import os
+import time
+import threading
+
+
+# serverless cold starts: sdks, indexes and lookup tables are all loaded on first use, so importing
+# the app stays cheap. warm_up() loads everything ahead of the first request instead, either
+# - in a background thread started at import (WARM_UP=1, on by default on vercel), where the loads
+#   overlap the first request's embedding call, or
+# - from the asgi lifespan startup, or GET /warmup for scheduled pings
+# numpy (about 100 ms) stays an eager import: every request embeds the question and searches
+# the vector index with it, so deferring it would only move the cost into the first request
+WARM_UP = os.environ.get('WARM_UP', '1' if os.environ.get('VERCEL') else '0') == '1'
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def warm_up():
+    from clients import get_genai_client, get_http_session
+    from embed_cache import get_embedding_cache
+    from answer_cache import get_answer_cache
+    from vector_index import get_search_engine
+    from bm25_index import get_bm25_index
+    from chunk_store import get_chunk_store
+    from context_store import get_context_store
+
+    # in the order a request needs them, every loader is thread safe so a request that
+    # gets there first simply waits for the load in progress instead of repeating it
+    steps = [
+        ('embedding_cache', get_embedding_cache),
+        ('http_session', get_http_session),
+        ('search_engine', get_search_engine),
+        ('bm25_index', get_bm25_index),
+        ('answer_cache', get_answer_cache),
+        ('chunk_store', get_chunk_store),
+        ('context_store', get_context_store),
+        ('genai_client', get_genai_client)
+    ]
+    timings = dict() # step -> milliseconds
+    for name, load in steps:
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e: # serve anyway, the first request will retry the load
+            print(f'ERROR warming up {name}: {e}')
+            continue
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    print(f'warm-up done in {sum(timings.values()):.0f} ms: {timings}') # report process
+    return timings
+
+
+def start_warm_up():
+    # at most one background warm-up per process
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+import subprocess
+
+
+# cold start cost of the serverless entry point, every run is a fresh interpreter:
+#   import          time to import app.py
+#   first request   first /api call, upstream apis replaced by local stubs
+#   warm request    a second call in the same process, for comparison
+# runs with and without the background warm-up, and lists the slowest imports
+# exits with status 1 when a median is over its budget, so the build can track cold starts
+# usage: python cold_start_report.py --runs 5 --import-budget-ms 1000 --first-request-budget-ms 2500
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = 'COLD_START_RESULT '
+
+
+def child(question):
+    # runs inside the fresh interpreter, only the standard library is imported before the app
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+
+    client = app.app.test_client()
+    first = client.post('/api', json=dict(question = question))
+    first_done = time.perf_counter()
+    client.post('/api', json=dict(question = f'{question} (follow-up)'))
+    warm_done = time.perf_counter()
+
+    print(RESULT_PREFIX + json.dumps(dict(
+        status = first.status_code,
+        import_ms = (imported - start) * 1000,
+        first_request_ms = (first_done - imported) * 1000,
+        warm_request_ms = (warm_done - first_done) * 1000
+    )))
+
+
+def run_child(env, workdir, importtime=False):
+    # unique question per run, so no cache on disk turns the first request into a hit
+    question = f'How do I submit the docker assignment? {uuid.uuid4().hex[:8]}'
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [
+        os.path.abspath(__file__), '--child', question
+    ]
+    completed = subprocess.run(command, env=env, cwd=workdir, capture_output=True, text=True)
+    result_lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if completed.returncode != 0 or not result_lines:
+        raise RuntimeError(f'cold start run failed:\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}')
+    return json.loads(result_lines[-1].removeprefix(RESULT_PREFIX)), completed.stderr
+
+
+def slowest_imports(importtime_log, limit=10):
+    # -X importtime lines: "import time: self [us] | cumulative | name", nesting shown by indentation
+    imports = list()
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.removeprefix('import time:').split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth in (1, 2): # modules the entry point and its own modules import
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import time and first request latency of app.py in fresh interpreters')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--upstream-latency', type=float, default=0.2, help='seconds added by the stub upstreams')
+    parser.add_argument('--import-budget-ms', type=float, default=float(os.environ.get('COLD_START_IMPORT_BUDGET_MS', 1000)))
+    parser.add_argument('--first-request-budget-ms', type=float, default=float(os.environ.get('COLD_START_FIRST_REQUEST_BUDGET_MS', 2500)))
+    parser.add_argument('--workdir', default=ROOT, help='folder holding the serving artifacts')
+    parser.add_argument('--output', default='cold_start_report.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS) # internal, one measured run
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    sys.path.insert(0, ROOT)
+    from benchmarks.stub_servers import embeddings_stub, gemini_stub
+
+    with embeddings_stub(latency=args.upstream_latency) as embed_stub, gemini_stub(latency=args.upstream_latency) as gem_stub:
+        env = dict(
+            os.environ,
+            PYTHONPATH = ROOT,
+            EMBEDDINGS_URL = f'{embed_stub.url}/openai/v1/embeddings',
+            GEMINI_BASE_URL = gem_stub.url,
+            GOOGLE_API_KEY = 'stub',
+            AIPIPE_KEY = 'stub',
+            EMBED_CACHE_PATH = '', # memory only, a cache on disk would be warm after the first run
+            METRICS_LOG = '0'
+        )
+
+        report = dict(runs = args.runs, upstream_latency = args.upstream_latency, modes = dict())
+        for mode, warm_up in [('lazy', '0'), ('warm-up', '1')]:
+            results = [run_child(dict(env, WARM_UP = warm_up), args.workdir)[0] for _ in range(args.runs)]
+            report['modes'][mode] = {
+                name: round(statistics.median(result[name] for result in results), 1)
+                for name in ('import_ms', 'first_request_ms', 'warm_request_ms')
+            }
+            report['modes'][mode]['errors'] = sum(result['status'] != 200 for result in results)
+
+        _, importtime_log = run_child(dict(env, WARM_UP = '0'), args.workdir, importtime=True)
+        report['slowest_imports'] = [dict(module = name, cumulative_ms = round(ms, 1)) for ms, name in slowest_imports(importtime_log)]
+
+    print(f'cold start over {args.runs} runs (medians), stub upstream latency {args.upstream_latency}s')
+    print(f'{'mode':<10}{'import ms':>12}{'first request ms':>18}{'warm request ms':>17}{'errors':>8}')
+    for mode, medians in report['modes'].items():
+        print(f'{mode:<10}{medians['import_ms']:>12.1f}{medians['first_request_ms']:>18.1f}{medians['warm_request_ms']:>17.1f}{medians['errors']:>8}')
+    print('slowest imports (app import and first request):')
+    for entry in report['slowest_imports']:
+        print(f'  {entry['cumulative_ms']:>8.1f} ms  {entry['module']}')
+
+    # the default mode on vercel is the one held to the budget
+    medians = report['modes']['warm-up']
+    report['budget'] = dict(import_ms = args.import_budget_ms, first_request_ms = args.first_request_budget_ms)
+    report['over_budget'] = [
+        name for name, budget in report['budget'].items() if medians[name] > budget
+    ] + (['errors'] if medians['errors'] else [])
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if report['over_budget']:
+        print(f'ERROR cold start over budget: {report['over_budget']} (budget {report['budget']})')
+        sys.exit(1)
+    print(f'cold start within budget {report['budget']}')
+
+
+if __name__ == '__main__':
+    main()
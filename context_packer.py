@@ -0,0 +1,127 @@
+import re
+
+from embed_gen import estimate_tokens
+
+
+
+class ContextPacker:
+    # assembles the gemini context from chunks in rank order:
+    #   1. splits of the same source, cut from one long chunk with overlap, are stitched back together
+    #   2. post and reply sections already in the context are left out, keyed by their <..|id> marker
+    #   3. the resulting blocks are added best first until the token budget is spent
+
+    SECTION_MARKER = re.compile(r'^<(original_post|reply)\|[^>]+>$')
+
+    def __init__(self, token_budget=8000, min_overlap=20, max_overlap=600):
+        self.token_budget = token_budget  # estimated tokens, 0 or None packs everything
+        self.min_overlap = min_overlap    # shortest overlap trusted as a continuation
+        self.max_overlap = max_overlap    # splits overlap by at most 500 characters
+
+
+    def pack(self, chunks_contents):
+        blocks = self._merge_splits(chunks_contents)
+
+        seen_sections = dict() # marker -> texts already in the context
+        packed, packed_tokens = list(), 0
+        for prefix, body in blocks:
+            text, new_sections = self._drop_seen_sections(prefix, body, seen_sections)
+            if text is None: # nothing new in this block
+                continue
+            tokens = estimate_tokens(text)
+            # a block over budget is skipped, a smaller one further down may still fit
+            if packed and self.token_budget and packed_tokens + tokens > self.token_budget:
+                continue
+            packed.append(text)
+            packed_tokens += tokens
+            for marker, section_text in new_sections:
+                seen_sections.setdefault(marker, list()).append(section_text)
+
+        context = '\n\n\n'.join(packed)
+        raw_tokens = estimate_tokens('\n\n\n'.join(chunks_contents))
+        context_tokens = estimate_tokens(context)
+        stats = dict(
+            chunks = len(chunks_contents),
+            blocks = len(packed),
+            raw_tokens = raw_tokens,
+            context_tokens = context_tokens,
+            saved_tokens = raw_tokens - context_tokens
+        )
+        return context, stats
+
+
+    def _merge_splits(self, chunks_contents):
+        # chunks sharing a source prefix, each block keeps the rank of its best chunk
+        groups = dict() # prefix -> list of bodies
+        for chunk_content in chunks_contents:
+            prefix, _, body = chunk_content.partition('\n')
+            groups.setdefault(prefix, list()).append(body)
+
+        blocks = list()
+        for prefix, bodies in groups.items():
+            pieces = list() # disjoint stretches of the source text
+            for body in bodies:
+                self._add_piece(pieces, body)
+            blocks.append((prefix, '\n...\n'.join(pieces)))
+        return blocks
+
+
+    def _add_piece(self, pieces, body):
+        for position, piece in enumerate(pieces):
+            merged = self._merge_overlapping(piece, body)
+            if merged is not None:
+                # the longer piece may now reach another one, keep merging
+                pieces.pop(position)
+                self._add_piece(pieces, merged)
+                return
+        pieces.append(body)
+
+
+    def _merge_overlapping(self, first, second):
+        if second in first:
+            return first
+        if first in second:
+            return second
+        overlap = self._overlap(first, second)
+        if overlap:
+            return first + second[overlap:]
+        overlap = self._overlap(second, first)
+        if overlap:
+            return second + first[overlap:]
+        return None
+
+
+    def _overlap(self, first, second):
+        # length of the longest end of `first` that is also the start of `second`
+        head = second[:self.min_overlap]
+        if len(head) < self.min_overlap:
+            return 0
+        position = first.find(head, max(0, len(first) - self.max_overlap))
+        while position != -1:
+            if second.startswith(first[position:]):
+                return len(first) - position
+            position = first.find(head, position + 1)
+        return 0
+
+
+    def _drop_seen_sections(self, prefix, body, seen_sections):
+        # the prefix line heads the first section, every marker line in the body starts a new one
+        sections = [[prefix]]
+        for line in body.split('\n'):
+            if self.SECTION_MARKER.match(line):
+                sections.append([line])
+            else:
+                sections[-1].append(line)
+
+        kept, new_sections = list(), list()
+        for position, (marker, *lines) in enumerate(sections):
+            section_text = '\n'.join(lines).strip()
+            if any(section_text in seen for seen in seen_sections.get(marker, [])):
+                if position == 0:
+                    kept.append([marker]) # keep the thread header for the replies that follow
+                continue
+            kept.append([marker, *lines])
+            new_sections.append((marker, section_text))
+
+        if not new_sections:
+            return None, new_sections
+        return '\n'.join(line for section in kept for line in section).strip(), new_sections
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+
+from post_store import PostStore
+from vector_index import INDEX_RELOAD_INTERVAL, file_version
+
+
+class ContextStore:
+    # lookup table from source id to the text shown in the response links
+    #   posts:          '<topic_id>/<post_number>' -> list of dict(url, text)
+    #   course_content: '<markdown slug>'          -> markdown text
+
+    def __init__(self, posts, course_content):
+        self.posts = posts
+        self.course_content = course_content
+        self.version = None # identifies the lookup file, set by load
+
+
+    @classmethod
+    def build(cls, posts, course_content_folder):
+        # index every forum post by its '<topic_id>/<post_number>' id
+        posts_by_id = dict()
+        for post in posts:
+            post_id = '/'.join(post['post_url'].split('/')[-2:])
+            posts_by_id.setdefault(post_id, []).append(dict(
+                url = post['post_url'],
+                text = post['markdown']
+            ))
+
+        # index every course content markdown by its file slug
+        course_content = dict()
+        for filename in sorted(os.listdir(course_content_folder)):
+            if not filename.endswith('.md'): continue
+            with open(f'{course_content_folder}/{filename}', 'r', encoding='utf-8') as f:
+                course_content[filename.removesuffix('.md')] = f.read()
+
+        return cls(posts_by_id, course_content)
+
+
+    @classmethod
+    def load(cls, path='data/json/context_lookup.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            lookup = json.load(f)
+        store = cls(lookup['posts'], lookup['course_content'])
+        store.version = file_version(path)
+        return store
+
+
+    def save(self, path='data/json/context_lookup.json'):
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(dict(posts = self.posts, course_content = self.course_content), f)
+        os.replace(f'{path}.tmp', path)
+
+
+    def get_links(self, source_urls):
+        # context_links will be a list of dicts containing url and text
+        context_links = []
+
+        for source_url in source_urls:
+            if 'discourse.onlinedegree.iitm.ac.in' in source_url:
+                source_id = '/'.join(source_url.split('/')[-2:])
+                context_links.extend(self.posts.get(source_id, []))
+
+            elif 'tds.s-anand.net' in source_url:
+                source_id = source_url.split('/')[-1]
+                if source_id in self.course_content:
+                    context_links.append(dict(
+                        url = source_url,
+                        text = self.course_content[source_id]
+                    ))
+
+        return context_links
+
+
+
+# process-wide lookup table, shared by all requests
+# the file is re-checked every INDEX_RELOAD_INTERVAL seconds so a rebuilt lookup is picked up
+_store = None
+_store_checked_at = 0.0
+_store_lock = threading.Lock()
+
+
+def get_context_store(
+    path='data/json/context_lookup.json',
+    posts_path='data/json/posts.jsonl',
+    course_content_folder='data/markdowns/course_content'
+):
+    global _store, _store_checked_at
+    if _store is None or time.monotonic() - _store_checked_at > INDEX_RELOAD_INTERVAL:
+        with _store_lock:
+            # another thread may have loaded or checked it while we waited
+            if _store is None or time.monotonic() - _store_checked_at > INDEX_RELOAD_INTERVAL:
+                _store_checked_at = time.monotonic()
+                _store = _load_context_store(path, posts_path, course_content_folder, _store)
+    return _store
+
+
+def _load_context_store(path, posts_path, course_content_folder, current):
+    if not os.path.exists(path):
+        if current is not None:
+            return current
+        # lookup not built yet, build it in memory from the raw data
+        store = ContextStore.build(PostStore(posts_path), course_content_folder)
+    elif current is not None and current.version == file_version(path):
+        return current
+    else:
+        try:
+            store = ContextStore.load(path)
+        except (OSError, ValueError) as e:
+            if current is None:
+                raise
+            print(f'ERROR reloading {path}, keeping the loaded context store: {e}')
+            return current
+    print(f'context store loaded with {len(store.posts)} posts and {len(store.course_content)} course pages')
+    return store
@@ -1,11 +1,18 @@
 import re
-import time
+import os
 import json
 from typing import List, Dict
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, date
 
+from clients import request_with_retry
+from rate_limiter import RateLimiter
+from post_store import PostStore, topic_of
+
 
 
 # Paste your discourse cookies below
@@ -15,18 +22,40 @@ _forum_session = "abcd"
 
 class DiscourseScraper:
 
-    def __init__(self, category_id: int):
-        self.base_url = "https://discourse.onlinedegree.iitm.ac.in"
+    POSTS_PER_PAGE = 20 # posts discourse returns per topic json page
+
+    def __init__(
+        self,
+        category_id: int,
+        base_url="https://discourse.onlinedegree.iitm.ac.in", # a local fake forum for offline benchmarks
+        concurrency=8,              # topics crawled at once in concurrent mode
+        requests_per_minute=600,
+        max_retries=5,
+        timeout=30
+    ):
+        self.base_url = base_url
         self.category_id = category_id
+        self.concurrency = concurrency
+        # small burst so a fresh crawl does not open with a flood of requests
+        self.rate_limiter = RateLimiter(requests_per_minute, burst=concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
         self.session = self._create_session()
 
 
-    def scrape_forum(self, start_date_str: str, end_date_str: str) -> List[Dict]:
+    def scrape_forum(self, start_date_str: str, end_date_str: str, concurrent=False, output_path='data/json/posts.jsonl') -> PostStore:
         # Convert date strings to datetime objects for comparison
         start_date = self._date(start_date_str)
         end_date = self._date(end_date_str)
+
+        # posts are written topic by topic as they are scraped, a crash keeps every finished topic
+        post_store = PostStore(output_path)
+        post_store.clear()
+
+        if concurrent:
+            self._scrape_forum_concurrent(start_date, end_date, post_store)
+            return post_store
     
-        all_posts = list()
         page_index = 0
         
         while True:
@@ -51,34 +80,233 @@ class DiscourseScraper:
                 # Get all posts from this topic that fall within our date range
                 topic_posts = self._scrape_topic_posts(topic, start_date, end_date)
                 print(f'scrapped {len(topic_posts)} posts under topic {topic['id']}')
-                all_posts.extend(topic_posts)
+                post_store.append(topic_posts)
             
             page_index += 1
-            time.sleep(0.1)  
 
-        with open('data/json/posts.json', 'w') as file:
-            json.dump(all_posts, file, indent=4)
-            
-        return all_posts
+        return post_store
+
+
+    def _scrape_forum_concurrent(self, start_date: date, end_date: date, post_store: PostStore) -> None:
+        # category pages are still listed one by one, each decides whether the crawl goes on,
+        # but the topics found are crawled on a thread pool while the listing continues
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            scheduled = list() # (topic, future) in listing order
+            page_index = 0
+            while True:
+                topics = self._get_latest_topics(page_index)
+                if not topics:
+                    break
+                if self._date(topics[0]['last_posted_at'][:10]) < start_date:
+                    break
+
+                for topic in topics:
+                    topic_last_posted = self._date(topic['last_posted_at'][:10])
+                    topic_created = self._date(topic['created_at'][:10])
+                    if (topic_last_posted < start_date) or (topic_created > end_date):
+                        continue
+                    scheduled.append((topic, executor.submit(self._scrape_topic_posts, topic, start_date, end_date)))
+                page_index += 1
+
+            # write in listing order so the output matches the sequential crawl
+            for topic, future in scheduled:
+                topic_posts = future.result()
+                print(f'scrapped {len(topic_posts)} posts under topic {topic['id']}')
+                post_store.append(topic_posts)
+
+
+    def sync_forum(self, start_date_str: str, end_date_str: str, posts_path='data/json/posts.jsonl', state_path='data/json/sync_state.json') -> PostStore:
+        # incremental crawl: every topic's last_posted_at, highest_post_number and posts_count are
+        # recorded after a sync, later syncs fetch only topics that moved past their mark and only
+        # the topic pages that can hold new posts, then merge them into the existing posts file
+        start_date = self._date(start_date_str)
+        end_date = self._date(end_date_str)
+        state = self._load_sync_state(state_path)
+        marks = state['topics']
+        post_store = PostStore(posts_path)
+
+        # list topics newest activity first, until a whole page has nothing new
+        changed_topics = list()
+        category_etag = state['category_etag']
+        page_index = 0
+        while True:
+            url = f"{self.base_url}/c/{self.category_id}.json?page={page_index}"
+            # conditional request for the first page, a 304 means no activity anywhere in the category
+            headers = {'If-None-Match': category_etag} if page_index == 0 and category_etag and post_store.exists() else None
+            try:
+                response = self._get(url, headers=headers)
+                if response.status_code == 304:
+                    print('forum unchanged since the last sync')
+                    return post_store
+                response.raise_for_status()
+                topics = response.json()['topic_list']['topics']
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error fetching latest topics page {page_index}: {e}")
+                break
+            if page_index == 0:
+                category_etag = response.headers.get('ETag')
+
+            if not topics or self._date(topics[0]['last_posted_at'][:10]) < start_date:
+                break
+
+            page_has_changes = False
+            for topic in topics:
+                topic_last_posted = self._date(topic['last_posted_at'][:10])
+                topic_created = self._date(topic['created_at'][:10])
+                if (topic_last_posted < start_date) or (topic_created > end_date):
+                    continue
+                mark = marks.get(str(topic['id']))
+                if mark and topic['last_posted_at'] <= mark['last_posted_at'] and topic.get('highest_post_number', 0) <= mark['highest_post_number']:
+                    continue
+                changed_topics.append((topic, mark))
+                page_has_changes = True
+
+            # topics are ordered by activity, the ones further down did not move either
+            if marks and not page_has_changes:
+                break
+            page_index += 1
+
+        # fetch the changed topics in parallel, each from its first page that can hold new posts,
+        # and stage them topic by topic next to the posts file
+        staged_store = PostStore(f'{posts_path}.new')
+        staged_store.clear()
+        n_new_posts = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            scheduled = [
+                (topic, mark, executor.submit(self._scrape_new_topic_posts, topic, mark, start_date, end_date))
+                for topic, mark in changed_topics
+            ]
+            for topic, mark, future in scheduled:
+                topic_posts = future.result()
+                if topic_posts is None: # failed, its mark stays put so the next sync retries it
+                    category_etag = None # and the category must not answer 304 until then
+                    continue
+                print(f'synced {len(topic_posts)} new posts under topic {topic['id']}')
+                staged_store.append(topic_posts)
+                n_new_posts += len(topic_posts)
+                post_numbers = [post['post_number'] for post in topic_posts] + [topic.get('highest_post_number', 0)]
+                marks[str(topic['id'])] = dict(
+                    last_posted_at = topic['last_posted_at'],
+                    highest_post_number = max(post_numbers + ([mark['highest_post_number']] if mark else [])),
+                    posts_count = topic.get('posts_count', len(topic_posts))
+                )
+
+        self._merge_posts(post_store, staged_store)
+        state['category_etag'] = category_etag
+        self._save_sync_state(state, state_path)
+        print(f'sync done: {len(changed_topics)} changed topics, {n_new_posts} new posts')
+        return post_store
+
+
+    def _scrape_new_topic_posts(self, topic: Dict, mark, start_date: date, end_date: date):
+        # new topics are crawled in full
+        if mark is None:
+            return self._scrape_topic_posts(topic, start_date, end_date)
+
+        # posts past the mark sit after the posts_count seen last time, start a page early
+        # so a few deleted posts shifting the stream cannot hide them
+        page_index = max(1, mark['posts_count'] // self.POSTS_PER_PAGE)
+        topic_posts = list()
+        while True:
+            try:
+                posts = self._get_topic_posts(topic['id'], page_index)
+            except (requests.RequestException, ValueError) as e:
+                print(f"Error fetching page {page_index} of topic {topic['id']}: {e}")
+                return None
+            if not posts:
+                break
+            for post in posts:
+                if post['post_number'] <= mark['highest_post_number']:
+                    continue
+                post_created = self._date(post['created_at'][:10])
+                post_updated = self._date(post['updated_at'][:10])
+                if (start_date <= post_created <= end_date) or (start_date <= post_updated <= end_date):
+                    topic_posts.append(self._extract_post_info(post))
+            page_index += 1
+        return topic_posts
+
+
+    def _merge_posts(self, post_store: PostStore, staged_store: PostStore) -> None:
+        # the posts file is streamed topic by topic into a new file, keeping the existing order,
+        # staged posts go after the other posts of their topic and new topics go last
+        if not post_store.exists():
+            os.replace(staged_store.path, post_store.path)
+            return
+
+        staged_topics = staged_store.index_topics()
+        merged_store = PostStore(f'{post_store.path}.tmp')
+        merged_store.clear()
+        for topic_posts in post_store.iter_topics():
+            topic_id = topic_of(topic_posts[0])
+            if topic_id in staged_topics:
+                topic_posts = self._merge_topic(topic_posts, staged_store.read_topic(*staged_topics.pop(topic_id)))
+            merged_store.append(topic_posts)
+        for offset, length in staged_topics.values():
+            merged_store.append(staged_store.read_topic(offset, length))
+
+        os.replace(merged_store.path, post_store.path)
+        os.remove(staged_store.path)
+
+
+    def _merge_topic(self, existing_posts: List[Dict], new_posts: List[Dict]) -> List[Dict]:
+        posts = {post['post_url']: post for post in existing_posts}
+        existing_urls = set(posts)
+        new_urls = {post['post_url'] for post in new_posts}
+        for post in new_posts:
+            # a new reply raises the reply count of the stored post it answers, which the chunker
+            # relies on, unless that post was fetched again and already counts it
+            if post['post_url'] not in existing_urls and post['reply_to_post_number']:
+                parent_url = f"{post['post_url'].rsplit('/', 1)[0]}/{post['reply_to_post_number']}"
+                if parent_url in existing_urls and parent_url not in new_urls:
+                    posts[parent_url]['reply_count'] += 1
+            posts[post['post_url']] = post
+        return list(posts.values())
+
+
+    def _load_sync_state(self, state_path: str) -> Dict:
+        if not os.path.exists(state_path):
+            return dict(category_etag = None, topics = dict())
+        with open(state_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+
+    def _save_sync_state(self, state: Dict, state_path: str) -> None:
+        # written to a temporary file first, a crash mid-write keeps the previous marks
+        with open(f'{state_path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(f'{state_path}.tmp', state_path)
     
     
     def _create_session(self):
-        domain = "discourse.onlinedegree.iitm.ac.in"
+        domain = urlparse(self.base_url).hostname
         session = requests.Session()
         cookies = dict(_t = _t, _forum_session = _forum_session)
 
         for name, value in cookies.items():
             session.cookies.set(name, value, domain=domain)
 
+        # one keep-alive connection per concurrent topic crawl
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
         session.headers.update({'Accept': 'application/json'})
         return session
 
 
+    def _get(self, url: str, headers=None) -> requests.Response:
+        # rate limited get, retried with backoff on rate limits, server errors and dropped connections
+        return request_with_retry(
+            'GET', url, session=self.session, max_retries=self.max_retries,
+            before_attempt=self.rate_limiter.acquire, headers=headers, timeout=self.timeout
+        )
+
+
 
     def _get_latest_topics(self, page_index: int) -> List[Dict]:
         url = f"{self.base_url}/c/{self.category_id}.json?page={page_index}"
         try:
-            response = self.session.get(url)
+            response = self._get(url)
             response.raise_for_status()
             return response.json()['topic_list']['topics']
         except (requests.RequestException, ValueError) as e:
@@ -92,7 +320,11 @@ class DiscourseScraper:
         
         while True:
             # Get posts for the current page of the topic
-            posts = self._get_topic_posts(topic['id'], page_index)
+            try:
+                posts = self._get_topic_posts(topic['id'], page_index)
+            except (requests.RequestException, ValueError) as e: # retries exhausted, keep crawling other topics
+                print(f"Error fetching page {page_index} of topic {topic['id']}: {e}")
+                break
             if not posts:
                 break
                 
@@ -110,19 +342,16 @@ class DiscourseScraper:
                 break
                 
             page_index += 1
-            time.sleep(0.1)  
         return topic_posts
     
 
     def _get_topic_posts(self, topic_id: str, page_index: int) -> List[Dict]:
         url = f"{self.base_url}/t/{topic_id}.json?include_raw=true&page={page_index}"
-        response = self.session.get(url)
-        if response.status_code == 200:
-            return response.json()['post_stream']['posts']
-        elif response.status_code == 404:
+        response = self._get(url)
+        if response.status_code == 404:
             return []
-        else:
-            raise Exception(response.json())
+        response.raise_for_status()
+        return response.json()['post_stream']['posts']
 
     def _extract_post_info(self, post: Dict) -> Dict:
         post_info = dict(
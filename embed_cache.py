@@ -0,0 +1,124 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+
+class EmbeddingCache:
+    # two tier cache for embeddings:
+    #   1. in-process LRU with size and TTL eviction
+    #   2. persistent sqlite table shared across restarts and workers, rows past the TTL are
+    #      ignored on read and pruned when the cache is opened
+    # the cache never fails a request: a disk tier that cannot be opened or written
+    # (read-only filesystem, database locked by another worker) is logged and skipped
+
+    def __init__(self, db_path='data/embed_cache.sqlite', max_size=2048, ttl=24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.memory = OrderedDict() # key -> (embedding, expires_at), most recently used last
+        self.lock = threading.Lock()
+        self.stats = dict(memory_hits = 0, disk_hits = 0, misses = 0)
+
+        # disk tier is optional, a None path keeps the cache in memory only
+        self.db = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+                self.db = sqlite3.connect(db_path, check_same_thread=False)
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS embeddings ('
+                    'key TEXT PRIMARY KEY, model TEXT, embedding BLOB, created_at REAL)'
+                )
+                self.db.execute('DELETE FROM embeddings WHERE created_at < ?', (time.time() - self.ttl,))
+                self.db.commit()
+            except (OSError, sqlite3.Error) as e:
+                print(f'ERROR opening embedding cache {db_path}, keeping it in memory only: {e}')
+                self.db = None
+
+
+    def key(self, content, model):
+        # collapse whitespace so trivially different copies of a question share a key
+        normalized = re.sub(r'\s+', ' ', content).strip()
+        return hashlib.sha256(f'{model}\n{normalized}'.encode('utf-8')).hexdigest()
+
+
+    def get(self, content, model):
+        key = self.key(content, model)
+        with self.lock:
+            # memory tier
+            entry = self.memory.get(key)
+            if entry is not None:
+                embedding, expires_at = entry
+                if expires_at > time.monotonic():
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return embedding
+                del self.memory[key] # expired
+
+            # disk tier, promote hits back into memory
+            if self.db is not None:
+                try:
+                    row = self.db.execute(
+                        'SELECT embedding FROM embeddings WHERE key = ? AND created_at >= ?',
+                        (key, time.time() - self.ttl)
+                    ).fetchone()
+                except sqlite3.Error as e: # e.g. locked by another worker, treat as a miss
+                    print(f'ERROR reading embedding cache: {e}')
+                    row = None
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(key, embedding)
+                    self.stats['disk_hits'] += 1
+                    return embedding
+
+            self.stats['misses'] += 1
+            return None
+
+
+    def put(self, content, model, embedding):
+        key = self.key(content, model)
+        with self.lock:
+            self._remember(key, embedding)
+            if self.db is not None:
+                try:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)',
+                        (key, model, np.asarray(embedding, dtype=np.float32).tobytes(), time.time())
+                    )
+                    self.db.commit()
+                except sqlite3.Error as e: # the memory tier still has it
+                    print(f'ERROR writing embedding cache: {e}')
+                    self.db.rollback()
+
+
+    def _remember(self, key, embedding):
+        self.memory[key] = (embedding, time.monotonic() + self.ttl)
+        self.memory.move_to_end(key)
+        # evict least recently used entries past the size limit
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+
+
+# process-wide cache shared by every Embedder in the worker
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    db_path = os.environ.get('EMBED_CACHE_PATH', 'data/embed_cache.sqlite'),
+                    max_size = int(os.environ.get('EMBED_CACHE_SIZE', 2048)),
+                    ttl = float(os.environ.get('EMBED_CACHE_TTL', 24 * 60 * 60))
+                )
+    return _cache
@@ -2,13 +2,53 @@ import os
 import re
 import json
 import time  
-import requests
+import hashlib
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from clients import get_http_session, get_async_http_client, request_with_retry
+from embed_cache import get_embedding_cache
+from embed_journal import EmbedJournal
+from rate_limiter import RateLimiter
+from metrics import span, CACHE_LOOKUPS, UPSTREAM_ERRORS, TOKENS
+
+
+def estimate_tokens(content):
+    # roughly 4 characters per token for english text, shared by the embedding batch
+    # budget and the context packing budget so both count the same way
+    return len(content) // 4 + 1
+
 
 
 class Embedder:
 
-    def create_chunk_embeddings(self, chunks_contents):
+    MODEL = 'text-embedding-3-small'
+
+    def __init__(
+        self,
+        url=None,
+        max_batch_items=64,         # inputs packed into one bulk request
+        max_batch_tokens=60_000,    # estimated tokens packed into one bulk request
+        concurrency=4,              # bulk requests in flight at once
+        requests_per_minute=300,
+        tokens_per_minute=1_000_000,
+        max_retries=5,
+        timeout=60
+    ):
+        # url can point at a local stub server for offline benchmarks
+        self.url = url or os.environ.get('EMBEDDINGS_URL', 'https://aipipe.org/openai/v1/embeddings')
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+
+    def create_chunk_embeddings(self, chunks_contents, bulk=False):
+        if bulk:
+            return self._create_chunk_embeddings_bulk(chunks_contents)
+
         # elements at the ith index will correspond to the ith chunk
         sources = [] # nested list containing source URLs for each chunk
         embeddings = [] # will contain embeddings for each chunk content
@@ -19,14 +59,14 @@ class Embedder:
             embed_vector = []
             try:
                 # create embedding
-                embed_vector = self.embed_content(chunk_content)
+                embed_vector = self.embed_content(chunk_content, use_cache=False) # chunks are embedded once, keep them out of the query cache
             except: # in case of any error
                 print(f'ERROR generating embedding for chunk at index {index}')
                 # save the sucessfully created embeddings
                 np.savez(
                     f'embed_data_{index - 1}.npz', # contains last successful chunk_index
                     sources = np.array(sources),
-                    embeddings = np.array(embeddings)
+                    embeddings = np.array(embeddings, dtype=np.float32) # float64 would double the file
                 )
                 return 
             # append
@@ -40,25 +80,205 @@ class Embedder:
         np.savez(
             'embed_data.npz',
             sources = np.array(sources),
-            embeddings = np.array(embeddings)
+            embeddings = np.array(embeddings, dtype=np.float32),
+            hashes = np.array([self.chunk_hash(chunk_content) for chunk_content in chunks_contents])
         )
         return 
-    
 
-    def embed_content(self, content):
-        URL = 'https://aipipe.org/openai/v1/embeddings'
+
+    def _create_chunk_embeddings_bulk(self, chunks_contents, shard_dir='embed_shards', output_path='embed_data.npz'):
+        # chunks are keyed by content hash, so vectors of unchanged chunks are reused
+        # from the current embeddings file and only new or changed chunks are embedded
+        hashes = [self.chunk_hash(chunk_content) for chunk_content in chunks_contents]
+        previous_hashes, previous_embeddings = self._load_previous_embeddings(output_path)
+        if previous_hashes == hashes:
+            print(f'{output_path} is up to date')
+            return
+        previous = dict(zip(previous_hashes, range(len(previous_hashes))))
+
+        # every finished batch is committed to an append-only shard, so a restart
+        # only embeds the chunks that are not in the journal yet
+        journal = EmbedJournal(shard_dir)
+        done = journal.completed_ids()
+        pending = dict() # hash -> index of its first chunk, duplicates are embedded once
+        for index, chunk_hash in enumerate(hashes):
+            if chunk_hash not in previous and chunk_hash not in done and chunk_hash not in pending:
+                pending[chunk_hash] = index
+        pending_ids = list(pending.values())
+        print(f'{len(pending_ids)} new or changed chunks to embed, {len(previous_hashes)} previous embeddings')
+
+        # pack pending chunks into list-input requests and keep several of them in flight
+        batches = [
+            [pending_ids[position] for position in batch]
+            for batch in self._pack_batches([chunks_contents[index] for index in pending_ids])
+        ]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                executor.submit(self.embed_batch, [chunks_contents[i] for i in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    embeddings = future.result()
+                except Exception as e: # retries exhausted, the batch stays pending for the next run
+                    print(f'ERROR generating embeddings for chunks {batch[0]} to {batch[-1]}: {e}')
+                    continue
+                journal.commit([hashes[i] for i in batch], embeddings)
+                print(f'embeddings generated for chunks {batch[0]} to {batch[-1]}') # report progress
+
+        # stop here if anything is missing, rerunning resumes from the journal
+        new_vectors = journal.vectors()
+        missing = [h for h in pending if h not in new_vectors]
+        if missing:
+            print(f'ERROR {len(missing)} chunks could not be embedded, run again to resume')
+            return
+
+        # assemble the serving file in chunk order, deleted chunks are simply left out
+        embeddings = np.array([
+            new_vectors[chunk_hash] if chunk_hash in new_vectors else previous_embeddings[previous[chunk_hash]]
+            for chunk_hash in hashes
+        ], dtype=np.float32)
+        np.savez(
+            output_path,
+            sources = np.array([self._get_source_urls(chunk_content) for chunk_content in chunks_contents]),
+            embeddings = embeddings,
+            hashes = np.array(hashes)
+        )
+        journal.clear()
+        return
+
+
+    def chunk_hash(self, chunk_content):
+        # stable id of a chunk: changes whenever its text or the embedding model changes
+        return hashlib.sha256(f'{self.MODEL}\n{chunk_content}'.encode('utf-8')).hexdigest()
+
+
+    def _load_previous_embeddings(self, path):
+        # files written before content hashing have no 'hashes' and cannot be reused
+        if not os.path.exists(path):
+            return [], None
+        embed_data = np.load(path)
+        if 'hashes' not in embed_data.files:
+            return [], None
+        return embed_data['hashes'].tolist(), embed_data['embeddings']
+
+
+    def _pack_batches(self, contents):
+        # greedily group consecutive indices under the item and token budgets
+        batches = []
+        batch, batch_tokens = [], 0
+        for index, content in enumerate(contents):
+            tokens = estimate_tokens(content)
+            if batch and (len(batch) >= self.max_batch_items or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(index)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+    def embed_batch(self, contents):
+        # one request with a list input, waits for the rate limiter first
+        self.rate_limiter.acquire(sum(estimate_tokens(content) for content in contents))
+        with span('embed_batch'):
+            response = self._post_with_retry(dict(model = self.MODEL, input = contents))
+        response_data = response.json()
+        self._record_usage(response_data)
+        data = response_data['data']
+        # results carry the position of their input, do not rely on response order
+        return [item['embedding'] for item in sorted(data, key=lambda item: item['index'])]
+
+
+    def _post_with_retry(self, data):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {os.environ.get('AIPIPE_KEY')}'
+        }
+        response = request_with_retry(
+            'POST', self.url, max_retries=self.max_retries,
+            on_error=lambda error: UPSTREAM_ERRORS.inc('embeddings'),
+            headers=headers, data=json.dumps(data), timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response
+
+
+    def embed_content(self, content, use_cache=True):
+        # repeated questions skip the network round trip
+        cache = get_embedding_cache() if use_cache else None
+        if cache is not None:
+            with span('embed_cache'):
+                embedding = cache.get(content, self.MODEL)
+            CACHE_LOOKUPS.inc('embedding', 'miss' if embedding is None else 'hit')
+            if embedding is not None:
+                return embedding
+
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {os.environ.get('AIPIPE_KEY')}'
         }
         data = {
-            "model": "text-embedding-3-small",
+            "model": self.MODEL,
             "input": content
         }
-        response = requests.post(URL, headers=headers, data=json.dumps(data))
-        embedding = response.json()['data'][0]['embedding']
+        session = get_http_session() # pooled per worker, created outside the timed stage
+        with span('embed'):
+            try:
+                response = session.post(self.url, headers=headers, data=json.dumps(data), timeout=self.timeout)
+                response_data = response.json()
+                embedding = response_data['data'][0]['embedding']
+            except Exception:
+                UPSTREAM_ERRORS.inc('embeddings')
+                raise
+        self._record_usage(response_data)
+
+        if cache is not None:
+            cache.put(content, self.MODEL, embedding)
         return embedding
-    
+
+
+    async def aembed_content(self, content, use_cache=True):
+        # async variant of embed_content for the asgi pipeline
+        cache = get_embedding_cache() if use_cache else None
+        if cache is not None:
+            with span('embed_cache'):
+                embedding = cache.get(content, self.MODEL)
+            CACHE_LOOKUPS.inc('embedding', 'miss' if embedding is None else 'hit')
+            if embedding is not None:
+                return embedding
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {os.environ.get('AIPIPE_KEY')}'
+        }
+        data = {
+            "model": self.MODEL,
+            "input": content
+        }
+        client = get_async_http_client()
+        with span('embed'):
+            try:
+                response = await client.post(self.url, headers=headers, json=data, timeout=self.timeout)
+                response_data = response.json()
+                embedding = response_data['data'][0]['embedding']
+            except Exception:
+                UPSTREAM_ERRORS.inc('embeddings')
+                raise
+        self._record_usage(response_data)
+
+        if cache is not None:
+            cache.put(content, self.MODEL, embedding)
+        return embedding
+
+
+
+    def _record_usage(self, response_data):
+        # prompt tokens reported by the embeddings api, if it reports them
+        usage = response_data.get('usage') or dict()
+        TOKENS.inc('embedding', amount=usage.get('prompt_tokens', 0))
 
 
     def _get_source_urls(self, chunk_content):
@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+
+
+class EmbedJournal:
+    # append-only shard store for a long embedding job
+    #   shard_00000.npz ...  ids and embeddings of one finished batch
+    #   journal.jsonl        one line per committed shard
+    # a shard only counts once its journal line is on disk, so a crash at any point
+    # loses at most the batches that were still in flight
+    # ids are chunk content hashes, so shards stay valid when the chunk list changes
+
+    def __init__(self, shard_dir='embed_shards'):
+        self.shard_dir = shard_dir
+        self.journal_path = f'{shard_dir}/journal.jsonl'
+        self.shards = list() # committed shard entries, dict(shard, ids)
+        self.next_shard = 0
+
+        if os.path.exists(self.journal_path):
+            self._replay()
+        else:
+            os.makedirs(self.shard_dir, exist_ok=True)
+
+
+    def _replay(self):
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+
+        entries = list()
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError: # empty or torn last line from a crash mid-write
+                continue
+
+        # journals from before content hash ids start with a fingerprint header and key their
+        # shards by row number, none of them can be reused
+        if any('shard' not in entry for entry in entries):
+            print(f'{self.journal_path} was written by an older version, starting over')
+            self.clear()
+            os.makedirs(self.shard_dir, exist_ok=True)
+            return
+
+        self.shards = [
+            entry for entry in entries
+            if os.path.exists(f'{self.shard_dir}/{entry['shard']}')
+        ]
+        # never reuse a shard number that the journal has seen
+        self.next_shard = len(entries)
+        print(f'resuming embedding job: {len(self.completed_ids())} chunks already embedded')
+
+
+    def _append(self, entry):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def completed_ids(self):
+        return {chunk_id for entry in self.shards for chunk_id in entry['ids']}
+
+
+    def commit(self, ids, embeddings):
+        # write the shard under a temporary name, rename it, then journal it
+        shard = f'shard_{self.next_shard:05d}.npz'
+        self.next_shard += 1
+        tmp_path = f'{self.shard_dir}/{shard}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                ids = np.array(ids),
+                embeddings = np.array(embeddings, dtype=np.float32)
+            )
+        os.replace(tmp_path, f'{self.shard_dir}/{shard}')
+
+        entry = dict(shard = shard, ids = list(ids))
+        self._append(entry)
+        self.shards.append(entry)
+
+
+    def vectors(self):
+        # chunk id -> embedding for every committed shard
+        vectors = dict()
+        for entry in self.shards:
+            shard_data = np.load(f'{self.shard_dir}/{entry['shard']}')
+            vectors.update(zip(shard_data['ids'].tolist(), shard_data['embeddings']))
+        return vectors
+
+
+    def clear(self):
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
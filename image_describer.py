@@ -0,0 +1,157 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Dict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import filetype
+import requests
+from google.genai import types
+
+from clients import get_genai_client, get_http_session, HTTP_TIMEOUT
+from rate_limiter import RateLimiter
+
+
+
+class ImageDescriber:
+    # describes the images posted on the forum with gemini, as a stage of its own
+    # images are stored under their content hash and descriptions under (post, image hashes),
+    # so every image is downloaded and every post described once across runs and chunk strategies
+
+    MODEL = 'gemini-2.0-flash-lite'
+
+    def __init__(self, cache_dir='data/image_cache', concurrency=4, requests_per_minute=60):
+        self.cache_dir = cache_dir
+        self.concurrency = concurrency # gemini requests in flight at once
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.lock = threading.Lock()
+        self.url_locks = defaultdict(threading.Lock) # one download per url even when posts share images
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(f'{cache_dir}/index.sqlite', check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, sha256 TEXT, mime TEXT)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS descriptions ('
+            'key TEXT PRIMARY KEY, post_url TEXT, description TEXT, created_at REAL)'
+        )
+        self.db.commit()
+
+
+    def describe_posts(self, posts: List[Dict]) -> Dict[str, str]:
+        # post url -> description for every post with images, repeated posts are described once
+        pending = {post['post_url']: post for post in posts if post['image_urls']}
+        descriptions = dict()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self.describe, post): post_url for post_url, post in pending.items()}
+            for done, future in enumerate(as_completed(futures), start=1):
+                descriptions[futures[future]] = future.result()
+                print(f'images described for {done}/{len(futures)} posts')
+        return descriptions
+
+
+    def describe(self, post: Dict) -> str:
+        if not post['image_urls']:
+            return ''
+
+        # image hashes come from the index, only images never seen before are downloaded
+        try:
+            images = [self._get_image(img_url) for img_url in post['image_urls']]
+        except (requests.RequestException, OSError) as e:
+            print(f'Images could not be downloaded for {post['post_url']}: {e}')
+            return ''
+
+        key = self._description_key(post, images)
+        with self.lock:
+            row = self.db.execute('SELECT description FROM descriptions WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return self._format(row[0])
+
+        image_prompts = []
+        for sha256, mime in images:
+            with open(f'{self.cache_dir}/{sha256}', 'rb') as f:
+                image_prompts.append(types.Part.from_bytes(data=f.read(), mime_type=mime)) # type: ignore
+
+        try:
+            self.rate_limiter.acquire()
+            response = get_genai_client().models.generate_content(
+                model = self.MODEL,
+                contents = [self._build_prompt(post)] + image_prompts
+            )
+            description = response.text
+            if not description:
+                raise ValueError('empty response')
+        except Exception as e:
+            # not cached, the next run tries again
+            print(f'Description could not be created for image in {post['post_url']}: {e}')
+            return ''
+
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO descriptions VALUES (?, ?, ?, ?)',
+                (key, post['post_url'], description, time.time())
+            )
+            self.db.commit()
+        return self._format(description)
+
+
+    def _get_image(self, img_url):
+        with self.lock:
+            url_lock = self.url_locks[img_url]
+        with url_lock:
+            return self._get_image_locked(img_url)
+
+
+    def _get_image_locked(self, img_url):
+        # (content hash, mime type) of the image, downloading it into the cache on first sight
+        with self.lock:
+            row = self.db.execute('SELECT sha256, mime FROM images WHERE url = ?', (img_url,)).fetchone()
+        if row is not None and os.path.exists(f'{self.cache_dir}/{row[0]}'):
+            return row[0], row[1]
+
+        response = get_http_session().get(img_url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        img_bytes = response.content
+        sha256 = hashlib.sha256(img_bytes).hexdigest()
+        mime = filetype.guess_mime(img_bytes)
+
+        # identical images posted under different urls share one file
+        path = f'{self.cache_dir}/{sha256}'
+        if not os.path.exists(path):
+            with open(f'{path}.{threading.get_ident()}.tmp', 'wb') as f:
+                f.write(img_bytes)
+            os.replace(f'{path}.{threading.get_ident()}.tmp', path)
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?)', (img_url, sha256, mime))
+            self.db.commit()
+        return sha256, mime
+
+
+    def _description_key(self, post, images):
+        image_hashes = ','.join(sha256 for sha256, _ in images)
+        return hashlib.sha256(f'{self.MODEL}\n{post['post_url']}\n{image_hashes}'.encode('utf-8')).hexdigest()
+
+
+    def _format(self, description):
+        return 'Image Description: \n' + description + '\n'
+
+
+    def _build_prompt(self, post):
+        return (
+            'I am building an AI assistant that answers student queries based on forum data. '
+            'I will convert the images posted by users in the forum to their textual descriptions. '
+            'These descriptions will be embedded so that they can be used for RAG.'
+            'When the assistant receives an image in the student query, it will also be converted to '
+            'its textual description and then to its embedding. '
+            'I have attached the image in the prompt. '
+            'You are supposed to give a detailed description of the image, the image might be a '
+            'part of a user question or an answer by a user to some question. Try to find out what '
+            'is being conveyed through the image and any text that the user has provided along with it. '
+            'IMPORTANT NOTE: If you think the image is some sort of a meme, joke, or something not related to studies, '
+            'reply with a simple "no useful information", and nothing else. '
+            'The description must not exceed 4-5 sentences.'
+            f'Text content in the user post: { post['markdown'].strip() if post['markdown'] else 'None' }'
+        )
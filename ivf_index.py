@@ -0,0 +1,152 @@
+import numpy as np
+
+
+
+class IVFIndex:
+    # inverted file index: vectors are bucketed under their nearest k-means centroid
+    # and a query only scans the buckets of its `nprobe` closest centroids
+
+    def __init__(self, vector_index, centroids, list_offsets, list_ids, nprobe=8):
+        self.vector_index = vector_index
+        self.sources = vector_index.sources
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64) # bucket i is list_ids[offsets[i]:offsets[i+1]]
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.nprobe = nprobe
+
+
+    @classmethod
+    def build(cls, vector_index, n_lists=None, n_iter=20, max_train=100_000, seed=0, nprobe=8):
+        vectors = vector_index.embeddings
+        n_vectors = vectors.shape[0]
+
+        # rule of thumb: about sqrt(N) buckets, at least one
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_vectors)))
+        n_lists = min(n_lists, n_vectors)
+
+        # train the coarse quantizer on a sample to keep build time bounded
+        rng = np.random.default_rng(seed)
+        if n_vectors > max_train:
+            train = vectors[rng.choice(n_vectors, max_train, replace=False)]
+        else:
+            train = vectors
+        centroids = cls._spherical_kmeans(train, n_lists, n_iter, rng)
+
+        # assign every vector to its closest centroid and group ids bucket by bucket
+        assignments = cls._assign(vectors, centroids)
+        list_ids = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        print(f'ivf index built with {n_lists} lists over {n_vectors} vectors')
+        return cls(vector_index, centroids, list_offsets, list_ids, nprobe=nprobe)
+
+
+    @classmethod
+    def load(cls, vector_index, path='ivf_index.npz', nprobe=8):
+        ivf_data = np.load(path)
+        list_ids = ivf_data['list_ids']
+        # refuse an index built for a different set of embeddings
+        if len(list_ids) != len(vector_index):
+            raise ValueError(f'{path} covers {len(list_ids)} vectors, embeddings have {len(vector_index)}')
+        # same row count is not enough, re-embedded chunks keep it but move the vectors
+        if 'fingerprint' not in ivf_data.files or str(ivf_data['fingerprint']) != vector_index.content_fingerprint():
+            raise ValueError(f'{path} was built for different embeddings, rebuild it')
+        return cls(vector_index, ivf_data['centroids'], ivf_data['list_offsets'], list_ids, nprobe=nprobe)
+
+
+    def save(self, path='ivf_index.npz'):
+        np.savez(
+            path,
+            centroids = self.centroids,
+            list_offsets = self.list_offsets,
+            list_ids = self.list_ids,
+            fingerprint = np.array(self.vector_index.content_fingerprint())
+        )
+
+
+    def __len__(self):
+        return len(self.vector_index)
+
+
+    def search(self, query_vec, k=15, nprobe=None, exact=False):
+        query = np.asarray(query_vec, dtype=np.float32).reshape(1, -1)
+        top_k_indices, top_k_scores = self.search_batch(query, k, nprobe=nprobe, exact=exact)
+        return top_k_indices[0], top_k_scores[0]
+
+
+    def search_batch(self, query_vecs, k=15, nprobe=None, exact=False):
+        # exact mode falls back to brute force, used to verify recall
+        if exact:
+            return self.vector_index.search_batch(query_vecs, k)
+
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        queries = np.asarray(query_vecs, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        query_norms[query_norms == 0] = 1.0
+        queries = queries / query_norms
+        if k <= 0:
+            return np.empty((queries.shape[0], 0), dtype=np.int64), np.empty((queries.shape[0], 0), dtype=np.float32)
+
+        # pick the closest buckets for every query in one product
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(centroid_scores, -nprobe, axis=1)[:, -nprobe:]
+
+        all_indices = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for row, query in enumerate(queries):
+            # gather candidate ids from the probed buckets
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[list_no]:self.list_offsets[list_no + 1]]
+                for list_no in probes[row]
+            ])
+            if len(candidates) == 0:
+                continue
+            scores = self.vector_index.embeddings[candidates] @ query
+
+            # partial selection then sort only the survivors (descending order)
+            row_k = min(k, len(candidates))
+            part = np.argpartition(scores, -row_k)[-row_k:]
+            part = part[np.argsort(-scores[part], kind='stable')]
+            all_indices[row, :row_k] = candidates[part]
+            all_scores[row, :row_k] = scores[part]
+        return all_indices, all_scores
+
+
+    @staticmethod
+    def _assign(vectors, centroids, block_size=65536):
+        # nearest centroid by cosine similarity, in blocks to cap memory
+        assignments = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], block_size):
+            block = vectors[start:start + block_size]
+            assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+
+    @classmethod
+    def _spherical_kmeans(cls, vectors, n_lists, n_iter, rng):
+        # initialise from random distinct training vectors
+        centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = cls._assign(vectors, centroids)
+
+            # new centroid = normalized mean of its members
+            counts = np.bincount(assignments, minlength=n_lists)
+            order = np.argsort(assignments, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+
+            # re-seed empty buckets with random vectors
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
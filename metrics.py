@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+
+# in-process metrics rendered in the prometheus text format, no client library needed
+# every worker process keeps its own values, prometheus sums them when it scrapes each worker
+# recording is a dict update under a lock, a few microseconds per span
+
+class Counter:
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = dict() # label values -> total
+        self.lock = threading.Lock()
+
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+
+class Histogram:
+    # upper bounds in seconds, from a cache hit to a slow gemini answer
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = dict() # label values -> [per bucket counts (last is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.values.items()]
+        for labels, counts, total, count in values:
+            # buckets are cumulative in the exposition format
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames + ('le',), labels + (str(bound),))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+
+def _format_labels(labelnames, labels):
+    if not labelnames:
+        return ''
+    pairs = (
+        f'{name}="{str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')}"'
+        for name, value in zip(labelnames, labels)
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+_registry = list()
+
+
+def counter(name, documentation, labelnames=()):
+    metric = Counter(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name, documentation, labelnames=(), buckets=Histogram.BUCKETS):
+    metric = Histogram(name, documentation, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render():
+    # body of the /metrics endpoint
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = histogram('rag_stage_duration_seconds', 'Time spent in each pipeline stage.', ['stage'])
+REQUEST_SECONDS = histogram('rag_request_duration_seconds', 'End to end time of an api request.', ['endpoint', 'status'])
+REQUESTS = counter('rag_requests_total', 'Api requests served.', ['endpoint', 'status'])
+CACHE_LOOKUPS = counter('rag_cache_lookups_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+UPSTREAM_ERRORS = counter('rag_upstream_errors_total', 'Failed or retried calls to upstream apis.', ['upstream'])
+TOKENS = counter('rag_tokens_total', 'Tokens sent to and received from the models, and saved by context packing.', ['kind'])
+
+
+
+# per-request timing: the request id and the spans recorded while serving it
+# spans outside a request (offline pipeline, bulk embedding threads) only feed the histograms
+METRICS_LOG = os.environ.get('METRICS_LOG', '1') == '1' # one json timing line per request
+
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class RequestTimer:
+
+    def __init__(self, endpoint, request_id=None):
+        self.endpoint = endpoint
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.status = 'ok'
+        self.spans = list() # (stage, seconds) in completion order
+        self.started = time.perf_counter()
+        self.seconds = None
+
+
+    def server_timing(self):
+        # Server-Timing header value, shown per request in the browser dev tools
+        total = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.spans]
+        return ', '.join(entries + [f'total;dur={total * 1000:.2f}'])
+
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        REQUEST_SECONDS.observe(self.seconds, self.endpoint, self.status)
+        REQUESTS.inc(self.endpoint, self.status)
+        if METRICS_LOG:
+            print(json.dumps(dict(
+                request_id = self.request_id,
+                endpoint = self.endpoint,
+                status = self.status,
+                total_ms = round(self.seconds * 1000, 2),
+                spans = [[stage, round(seconds * 1000, 2)] for stage, seconds in self.spans]
+            )))
+
+
+@contextmanager
+def request_context(endpoint, request_id=None):
+    timer = RequestTimer(endpoint, request_id)
+    token = _current_request.set(timer)
+    try:
+        yield timer
+    except BaseException:
+        timer.status = 'error'
+        raise
+    finally:
+        try:
+            _current_request.reset(token)
+        except ValueError: # generator finished in another context, e.g. closed by the server
+            _current_request.set(None)
+        timer.finish()
+
+
+class span:
+    # times a pipeline stage:  with span('search'): ...
+    # a plain class instead of @contextmanager, entering and leaving cost about a microsecond
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(seconds, self.stage)
+        timer = _current_request.get()
+        if timer is not None:
+            timer.spans.append((self.stage, seconds))
+        return False
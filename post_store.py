@@ -0,0 +1,86 @@
+import os
+import json
+from typing import List, Dict, Iterator
+
+
+
+class PostStore:
+    # forum posts as json lines, one post per line
+    # posts are appended a whole topic at a time, so the posts of a topic are always
+    # contiguous and a crash mid-crawl keeps every topic that was finished
+
+    def __init__(self, path='data/json/posts.jsonl'):
+        self.path = path
+
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+
+    def clear(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        open(self.path, 'w', encoding='utf-8').close()
+
+
+    def append(self, posts: List[Dict]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(post) + '\n' for post in posts))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def __iter__(self) -> Iterator[Dict]:
+        # streams the posts, only one line is held in memory
+        if not self.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError: # empty or torn last line from a crash mid-write
+                    continue
+
+
+    def index_topics(self) -> Dict[str, tuple]:
+        # topic id -> (byte offset, byte length) of its posts, to read single topics back later
+        topics = dict()
+        if not self.exists():
+            return topics
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    topic_id = topic_of(json.loads(line))
+                except ValueError:
+                    offset += len(line)
+                    continue
+                start, length = topics.get(topic_id, (offset, 0))
+                topics[topic_id] = (start, length + len(line))
+                offset += len(line)
+        return topics
+
+
+    def read_topic(self, offset: int, length: int) -> List[Dict]:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            lines = f.read(length).decode('utf-8').splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+    def iter_topics(self) -> Iterator[List[Dict]]:
+        # posts grouped by topic, one thread in memory at a time
+        topic_posts, current_topic = list(), None
+        for post in self:
+            topic_id = topic_of(post)
+            if topic_id != current_topic and topic_posts:
+                yield topic_posts
+                topic_posts = list()
+            topic_posts.append(post)
+            current_topic = topic_id
+        if topic_posts:
+            yield topic_posts
+
+
+
+def topic_of(post: Dict) -> str:
+    return post['post_url'].split('/')[-2] # topic id
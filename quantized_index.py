@@ -0,0 +1,170 @@
+import numpy as np
+
+
+
+class QuantizedIndex:
+    # compressed copy of the embeddings for a cheap first pass, followed by an exact rerank
+    # of the best `rerank` candidates against the full precision vectors
+    #   float16  2 bytes per dimension
+    #   int8     1 byte per dimension + one float32 scale per vector
+    #   binary   1 bit per dimension (sign codes), scored by hamming distance
+    # `dims` keeps only the leading dimensions (text-embedding-3 vectors stay usable when
+    # truncated), which shrinks every format further
+    # only the codes are resident, with the vector index loaded from embed_store the full
+    # precision rows stay memory-mapped on disk and just the shortlist is read per query
+
+    FORMATS = ('float16', 'int8', 'binary')
+
+    def __init__(self, vector_index, codes, scales=None, fmt='int8', dims=None, rerank=100):
+        if fmt not in self.FORMATS:
+            raise ValueError(f'unknown format {fmt}, expected one of {self.FORMATS}')
+        self.vector_index = vector_index
+        self.sources = vector_index.sources
+        self.codes = codes
+        self.scales = scales # int8 only, per-vector dequantization scale
+        self.fmt = fmt
+        self.dims = dims or vector_index.embeddings.shape[1]
+        self.rerank = rerank
+
+
+    @classmethod
+    def build(cls, vector_index, fmt='int8', dims=None, rerank=100, block_size=65536):
+        n_vectors, full_dims = vector_index.embeddings.shape
+        dims = min(dims or full_dims, full_dims)
+
+        code_width = (dims + 7) // 8 if fmt == 'binary' else dims
+        code_dtype = dict(float16 = np.float16, int8 = np.int8, binary = np.uint8)[fmt]
+        codes = np.empty((n_vectors, code_width), dtype=code_dtype)
+        scales = np.empty(n_vectors, dtype=np.float32) if fmt == 'int8' else None
+
+        # encode block by block so a memory-mapped store is never fully read into memory
+        for start in range(0, n_vectors, block_size):
+            block = cls._truncate(np.asarray(vector_index.embeddings[start:start + block_size], dtype=np.float32), dims)
+            if fmt == 'float16':
+                codes[start:start + block_size] = block.astype(np.float16)
+            elif fmt == 'int8':
+                block_scales = np.abs(block).max(axis=1) / 127
+                block_scales[block_scales == 0] = 1.0
+                codes[start:start + block_size] = np.round(block / block_scales[:, None]).astype(np.int8)
+                scales[start:start + block_size] = block_scales
+            else:
+                codes[start:start + block_size] = np.packbits(block > 0, axis=1)
+
+        print(f'{fmt} index built over {n_vectors} vectors with {dims} dimensions')
+        return cls(vector_index, codes, scales, fmt=fmt, dims=dims, rerank=rerank)
+
+
+    @classmethod
+    def load(cls, vector_index, path='quantized_index.npz', rerank=100):
+        quantized_data = np.load(path)
+        codes = quantized_data['codes']
+        # refuse codes built for a different set of embeddings
+        if len(codes) != len(vector_index):
+            raise ValueError(f'{path} covers {len(codes)} vectors, embeddings have {len(vector_index)}')
+        # same row count is not enough, re-embedded chunks keep it but change the vectors
+        if 'fingerprint' not in quantized_data.files or str(quantized_data['fingerprint']) != vector_index.content_fingerprint():
+            raise ValueError(f'{path} was built for different embeddings, rebuild it')
+        scales = quantized_data['scales'] if 'scales' in quantized_data else None
+        return cls(
+            vector_index, codes, scales,
+            fmt=str(quantized_data['fmt']), dims=int(quantized_data['dims']), rerank=rerank
+        )
+
+
+    def save(self, path='quantized_index.npz'):
+        arrays = dict(
+            codes = self.codes, fmt = np.array(self.fmt), dims = np.array(self.dims),
+            fingerprint = np.array(self.vector_index.content_fingerprint())
+        )
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        np.savez(path, **arrays)
+
+
+    def __len__(self):
+        return len(self.vector_index)
+
+
+    @property
+    def nbytes(self):
+        # resident size of the first pass data
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+    def search(self, query_vec, k=15, rerank=None, exact=False):
+        query = np.asarray(query_vec, dtype=np.float32).reshape(1, -1)
+        top_k_indices, top_k_scores = self.search_batch(query, k, rerank=rerank, exact=exact)
+        return top_k_indices[0], top_k_scores[0]
+
+
+    def search_batch(self, query_vecs, k=15, rerank=None, exact=False, block_size=65536):
+        # exact mode falls back to brute force, used to verify recall
+        if exact:
+            return self.vector_index.search_batch(query_vecs, k)
+
+        queries = np.asarray(query_vecs, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        query_norms[query_norms == 0] = 1.0
+        queries = queries / query_norms
+        if k <= 0:
+            return np.empty((queries.shape[0], 0), dtype=np.int64), np.empty((queries.shape[0], 0), dtype=np.float32)
+
+        # first pass: approximate scores from the codes, keep a shortlist per query
+        n_candidates = min(max(rerank or self.rerank, k), len(self))
+        candidates = self._shortlist(self._truncate(queries, self.dims), n_candidates, block_size)
+
+        # second pass: exact cosine similarity of the shortlist, sort only the final k
+        k = min(k, n_candidates)
+        top_k_indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        top_k_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            row_candidates = np.sort(candidates[row]) # ascending ids read the mapped file in order
+            scores = np.asarray(self.vector_index.embeddings[row_candidates], dtype=np.float32) @ query
+            part = np.argpartition(scores, -k)[-k:]
+            part = part[np.argsort(-scores[part], kind='stable')]
+            top_k_indices[row] = row_candidates[part]
+            top_k_scores[row] = scores[part]
+        return top_k_indices, top_k_scores
+
+
+    def _shortlist(self, queries, n_candidates, block_size):
+        if self.fmt == 'binary':
+            query_codes = np.packbits(queries > 0, axis=1)
+
+        best_indices = np.empty((queries.shape[0], 0), dtype=np.int64)
+        best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, len(self), block_size):
+            block = self.codes[start:start + block_size]
+            if self.fmt == 'binary':
+                # fewer differing sign bits means a smaller angle
+                scores = np.stack([
+                    -np.bitwise_count(np.bitwise_xor(block, query_code)).sum(axis=1, dtype=np.int32)
+                    for query_code in query_codes
+                ]).astype(np.float32)
+            else:
+                scores = queries @ block.astype(np.float32).T
+                if self.fmt == 'int8':
+                    scores *= self.scales[start:start + block_size]
+
+            # partial selection inside the block, merged with the candidates kept so far
+            block_n = min(n_candidates, scores.shape[1])
+            part = np.argpartition(scores, -block_n, axis=1)[:, -block_n:]
+            cand_indices = np.concatenate([best_indices, part + start], axis=1)
+            cand_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+            if cand_scores.shape[1] > n_candidates:
+                keep = np.argpartition(cand_scores, -n_candidates, axis=1)[:, -n_candidates:]
+                cand_indices = np.take_along_axis(cand_indices, keep, axis=1)
+                cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            best_indices, best_scores = cand_indices, cand_scores
+        return best_indices
+
+
+    @staticmethod
+    def _truncate(vectors, dims):
+        # leading dimensions, renormalized to unit length
+        vectors = vectors[:, :dims]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
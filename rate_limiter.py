@@ -0,0 +1,62 @@
+import time
+import threading
+
+
+
+class RateLimiter:
+    # token buckets for requests per minute and tokens per minute, refilled continuously
+    # a None limit disables that bucket, burst caps how many requests can go out at once
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, burst=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_capacity = burst or requests_per_minute or 0
+        self.request_allowance = float(self.request_capacity)
+        self.token_allowance = float(tokens_per_minute or 0)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self, tokens=0):
+        # block until both buckets can pay for one request of `tokens` tokens
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute) # an oversized request waits for a full bucket
+        while True:
+            with self.lock:
+                self._refill()
+                wait = max(self._request_wait(), self._token_wait(tokens))
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self.request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self.token_allowance -= tokens
+                    return
+            time.sleep(wait)
+
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.requests_per_minute:
+            self.request_allowance = min(
+                self.request_capacity,
+                self.request_allowance + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self.token_allowance = min(
+                self.tokens_per_minute,
+                self.token_allowance + elapsed * self.tokens_per_minute / 60
+            )
+
+
+    def _request_wait(self):
+        if not self.requests_per_minute or self.request_allowance >= 1:
+            return 0
+        return (1 - self.request_allowance) * 60 / self.requests_per_minute
+
+
+    def _token_wait(self, tokens):
+        if not self.tokens_per_minute or self.token_allowance >= tokens:
+            return 0
+        return (tokens - self.token_allowance) * 60 / self.tokens_per_minute
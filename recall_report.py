@@ -0,0 +1,88 @@
+import time
+import argparse
+
+import numpy as np
+
+from ivf_index import IVFIndex
+from quantized_index import QuantizedIndex
+from vector_index import VectorIndex
+
+
+# compares approximate search against the exact brute-force path
+# usage: python recall_report.py --k 15 --nprobe 1 2 4 8 16 32 --formats float16 int8 binary --dims 0 512
+
+
+def recall_at_k(exact_indices, approx_indices):
+    # fraction of the exact top k that the approximate search also returned
+    hits = [
+        len(set(exact_row[exact_row >= 0]) & set(approx_row[approx_row >= 0]))
+        for exact_row, approx_row in zip(exact_indices, approx_indices)
+    ]
+    return sum(hits) / exact_indices.size
+
+
+def make_queries(index, n_queries, noise, seed=0):
+    # perturbed copies of stored vectors stand in for real student questions
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), min(n_queries, len(index)), replace=False)
+    queries = index.embeddings[rows]
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='recall@k of the ivf index against exact search')
+    parser.add_argument('--embeddings', default='embed_data.npz')
+    parser.add_argument('--ivf', default='ivf_index.npz')
+    parser.add_argument('--k', type=int, default=15)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.5)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--formats', nargs='+', default=list(QuantizedIndex.FORMATS), choices=QuantizedIndex.FORMATS)
+    parser.add_argument('--dims', type=int, nargs='+', default=[0, 512, 256]) # 0 keeps every dimension
+    parser.add_argument('--rerank', type=int, default=100) # shortlist size for the exact rerank
+    args = parser.parse_args()
+
+    index = VectorIndex.from_npz(args.embeddings)
+    try:
+        ivf = IVFIndex.load(index, args.ivf)
+    except (OSError, ValueError):
+        ivf = IVFIndex.build(index)
+    queries = make_queries(index, args.queries, args.noise)
+
+    # ground truth from brute force
+    start = time.perf_counter()
+    exact_indices, _ = ivf.search_batch(queries, args.k, exact=True)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f'vectors: {len(index)}  lists: {len(ivf.centroids)}  queries: {len(queries)}  k: {args.k}')
+    print(f'{"mode":>12} {f"recall@{args.k}":>10} {"ms/query":>10}')
+    print(f'{"exact":>12} {1.0:>10.4f} {exact_ms:>10.3f}')
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        approx_indices, _ = ivf.search_batch(queries, args.k, nprobe=nprobe)
+        approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = recall_at_k(exact_indices, approx_indices)
+        print(f'{f"nprobe={nprobe}":>12} {recall:>10.4f} {approx_ms:>10.3f}')
+
+    # memory versus recall of the compressed first pass, each followed by the exact rerank
+    full_bytes = index.embeddings.nbytes
+    print()
+    print(f'compressed codes with exact rerank of the top {args.rerank}')
+    print(f'{"mode":>16} {"resident MB":>12} {"smaller":>8} {f"recall@{args.k}":>10} {"ms/query":>10}')
+    print(f'{"float32":>16} {full_bytes / 1e6:>12.2f} {1.0:>7.1f}x {1.0:>10.4f} {exact_ms:>10.3f}')
+    for fmt in args.formats:
+        for dims in args.dims:
+            quantized = QuantizedIndex.build(index, fmt=fmt, dims=dims or None, rerank=args.rerank)
+            start = time.perf_counter()
+            approx_indices, _ = quantized.search_batch(queries, args.k)
+            approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = recall_at_k(exact_indices, approx_indices)
+            print(
+                f'{f"{fmt}/{quantized.dims}":>16} {quantized.nbytes / 1e6:>12.2f} '
+                f'{full_bytes / quantized.nbytes:>7.1f}x {recall:>10.4f} {approx_ms:>10.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,48 @@
 import os 
+import sys
 import json
+import compileall
+import subprocess
 import numpy as np
 
 from embed_gen import Embedder
 from chunk_creator import ChunkCreator
 from solution_creator import SolutionCreator
 from discourse_scraper import DiscourseScraper
+from context_store import ContextStore
+from chunk_store import ChunkStore
+from bm25_index import BM25Index
+from post_store import PostStore
+from ivf_index import IVFIndex
+from quantized_index import QuantizedIndex
+from vector_index import VectorIndex, stored_fingerprint
 
 # Initialize discourse scraper with course id of TDS (34)
 discourse_scraper = DiscourseScraper(category_id=34) # 
 
-# scrape the posts if 'posts.json' does not exist
-if not os.path.exists('data/json/posts.json'):  # TDS course has ID-34 
-    discourse_scraper.scrape_forum(start_date_str="2025-01-01", end_date_str="2025-04-14")
-# else load the posts from storage
+# posts are stored as json lines and streamed topic by topic, never loaded as a whole
+post_store = PostStore('data/json/posts.jsonl')
+
+# scrape the posts if 'posts.jsonl' does not exist, FORUM_SYNC=1 fetches only the activity since the last run
+if not post_store.exists() or os.environ.get('FORUM_SYNC'):  # TDS course has ID-34 
+    discourse_scraper.sync_forum(start_date_str="2025-01-01", end_date_str="2025-04-14")
 else:
-    with open('data/json/posts.json', 'r', encoding='utf-8') as file:
-        posts = json.load(file)
-    print('posts.json loaded!')
+    print('posts.jsonl found!')
+
+
+def outdated(artifact, source='embed_data.npz'):
+    # artifacts are rebuilt whenever their source (the embeddings, or the synced posts) is newer than them
+    return os.path.exists(source) and (
+        not os.path.exists(artifact) or os.path.getmtime(artifact) < os.path.getmtime(source)
+    )
 
 
-# chunk creation
+# chunk creation, redone after a FORUM_SYNC brought new posts
 chunk_creator = ChunkCreator()
-if not os.path.exists('data/json/chunks.json'):
+if not os.path.exists('data/json/chunks.json') or outdated('data/json/chunks.json', source='data/json/posts.jsonl'):
     print('creating chunks...')
 
-    chunks = chunk_creator.start_chunk_creation(posts, 'data/markdowns/course_content')
+    chunks = chunk_creator.start_chunk_creation_by_topic(post_store.iter_topics(), 'data/markdowns/course_content')
 
     with open('data/json/chunks.json', 'w', encoding='utf-8') as f:
 
@@ -38,18 +55,97 @@ else:
     print('chunks.json loaded!')
     print('total chunks: ', len(chunks))
 
-# embedding generation 
-embedder = Embedder()
-if not os.path.exists('embed_data.npz'):
-    print('generating embeddings...')
 
-    embedder.create_chunk_embeddings(chunks)
+# source id -> text lookup used to build the response links
+if not os.path.exists('data/json/context_lookup.json') or outdated('data/json/context_lookup.json', source='data/json/posts.jsonl'):
+    print('creating context lookup...')
 
-    print('embeddings created!')
+    ContextStore.build(post_store, 'data/markdowns/course_content').save('data/json/context_lookup.json')
 
-else:
+    print('context_lookup.json created!')
+
+# embedding generation, chunks are keyed by content hash so only new or changed ones
+# are embedded (an interrupted run resumes from the journal in embed_shards/)
+embedder = Embedder()
+print('generating embeddings...')
+
+embedder.create_chunk_embeddings(chunks, bulk=True) # packed, concurrent and rate limited requests
+
+if os.path.exists('embed_data.npz'):
     embed_data = np.load('embed_data.npz')
     print('embed_data.npz loaded!')
 
     embeddings = embed_data['embeddings']
-    sources = embed_data['sources']
\ No newline at end of file
+    sources = embed_data['sources']
+
+
+def built_for_other_embeddings(artifact):
+    # derived indexes carry the fingerprint of the embeddings they were built from, a re-embedding
+    # that keeps the row count (or a copied file with a newer mtime) is caught by it
+    return os.path.exists('embed_data.npz') and stored_fingerprint(artifact) != embed_fingerprint
+
+
+embed_fingerprint = VectorIndex.from_npz('embed_data.npz').content_fingerprint() if os.path.exists('embed_data.npz') else None
+
+
+# raw float32 store that gunicorn workers memory-map instead of decompressing the .npz
+if outdated('embed_store/embeddings.npy') or outdated('embed_store/fingerprint'):
+    print('writing embedding store...')
+
+    VectorIndex.from_npz('embed_data.npz').write_store('embed_store')
+
+    print('embed_store created!')
+
+
+# chunk texts as a memory-mapped blob + offsets, read by the serving path instead of chunks.json
+if outdated('chunk_store/current', source='data/json/chunks.json'):
+    print('writing chunk store...')
+
+    ChunkStore.from_chunks(chunks).write('chunk_store')
+
+    print('chunk_store created!')
+
+
+# lexical index for hybrid retrieval, rows follow the chunk store
+if outdated('bm25_index.npz', source='data/json/chunks.json'):
+    print('building bm25 index...')
+
+    BM25Index.build(chunks).save('bm25_index.npz')
+
+    print('bm25_index.npz created!')
+
+
+# approximate nearest-neighbour index, persisted next to the embeddings
+if outdated('ivf_index.npz') or built_for_other_embeddings('ivf_index.npz'):
+    print('building ivf index...')
+
+    IVFIndex.build(VectorIndex.from_npz('embed_data.npz')).save('ivf_index.npz')
+
+    print('ivf_index.npz created!')
+
+
+# compressed codes for SEARCH_ENGINE=quantized, QUANTIZED_FORMAT is float16, int8 or binary
+# and QUANTIZED_DIMS keeps only the leading dimensions (0 keeps all of them)
+if outdated('quantized_index.npz') or built_for_other_embeddings('quantized_index.npz'):
+    print('building quantized index...')
+
+    QuantizedIndex.build(
+        VectorIndex.from_npz('embed_data.npz'),
+        fmt = os.environ.get('QUANTIZED_FORMAT', 'int8'),
+        dims = int(os.environ.get('QUANTIZED_DIMS', 0)) or None
+    ).save('quantized_index.npz')
+
+    print('quantized_index.npz created!')
+
+
+# bytecode for the serving modules, so a fresh instance does not compile them on first import
+compileall.compile_dir('.', maxlevels=0, quiet=1)
+
+
+# cold start of the serving entry point (import time and first request against local stubs),
+# tracked on every build, COLD_START_STRICT=1 fails the build when it is over budget
+print('measuring cold start...')
+
+cold_start_status = subprocess.run([sys.executable, 'cold_start_report.py', '--runs', '3']).returncode
+if cold_start_status and os.environ.get('COLD_START_STRICT'):
+    sys.exit('cold start over budget, see cold_start_report.json')
\ No newline at end of file
@@ -1,71 +1,284 @@
 import os
 import json
+import asyncio
 import base64
 import filetype
-import numpy as np 
+from contextlib import contextmanager
 
 
-from google import genai
-from google.genai import types
-
+from clients import get_genai_client
 from embed_gen import Embedder
+from context_store import get_context_store
+from answer_cache import get_answer_cache
+from chunk_store import get_chunk_store
+from context_packer import ContextPacker
+from bm25_index import get_bm25_index, reciprocal_rank_fusion
+from vector_index import get_search_engine, get_vector_index
+from metrics import span, CACHE_LOOKUPS, UPSTREAM_ERRORS, TOKENS
+
+
+# chunks sent to gemini, and how many dense and bm25 results are fused into them
+RETRIEVAL_K = int(os.environ.get('RETRIEVAL_K', 15))
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 50))
+# estimated tokens of retrieved context sent to gemini, 0 sends every chunk
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 8000))
 
 
 
 class SolutionCreator():
     def create_solution(self, query):
 
-        print('creating solution...') # report process
+        prepared = self._prepare(query)
 
-        # get query text
-        query_text = query.get('question')
+        # paraphrases of an already answered question reuse its response
+        if prepared['cached_solution'] is not None:
+            return prepared['cached_solution']
 
-        if not query_text:
-            query_text = ""
-        
-        # get query image (optional)
+        # get answer from gemini
+        answer = self._get_answer_from_gemini(prepared['prompt_contents'])
+
+        # create 'context_links' list containign source_url and text
+        context_links = self._create_context_links(prepared['top_sources'])
+
+        print(answer)
+
+        solution = dict(
+            answer = answer,
+            links = context_links
+        )
+        self._cache_solution(prepared, solution)
+        return solution
+
+
+    async def acreate_solution(self, query):
+        # same pipeline as create_solution, but upstream calls are awaited instead of
+        # blocking the worker, and steps that do not depend on each other overlap
+
+        prepared = await self._aprepare(query)
+
+        if prepared['cached_solution'] is not None:
+            return prepared['cached_solution']
+
+        # context links do not depend on the answer, build them while gemini is working
+        answer, context_links = await asyncio.gather(
+            self._aget_answer_from_gemini(prepared['prompt_contents']),
+            asyncio.to_thread(self._create_context_links, prepared['top_sources'])
+        )
+
+        print(answer)
+
+        solution = dict(
+            answer = answer,
+            links = context_links
+        )
+        self._cache_solution(prepared, solution)
+        return solution
+
+
+    def stream_solution(self, query):
+        # streaming variant of create_solution, yields (event, data) pairs:
+        #   ('links', context_links) as soon as retrieval is done
+        #   ('token', text) for every piece of the answer gemini streams back
+        #   ('done', dict(answer)) with the complete answer at the end
+
+        prepared = self._prepare(query)
+
+        if prepared['cached_solution'] is not None:
+            yield from self._cached_events(prepared['cached_solution'])
+            return
+
+        # links are ready long before the answer, send them right away
+        context_links = self._create_context_links(prepared['top_sources'])
+        yield 'links', context_links
+
+        print('crafting an answer...')
+
+        # the span covers the whole stream, including the time the client takes to read it
+        answer, chunk = '', None
+        with span('gemini'), self._count_upstream_errors('gemini'):
+            for chunk in get_genai_client().models.generate_content_stream(
+                model='gemini-2.0-flash',
+                contents = prepared['prompt_contents']
+            ):
+                if chunk.text:
+                    answer += chunk.text
+                    yield 'token', chunk.text
+        self._record_usage(chunk) # the last chunk carries the usage of the whole answer
+
+        self._cache_solution(prepared, dict(answer = answer, links = context_links))
+        yield 'done', dict(answer = answer)
+
+
+    async def astream_solution(self, query):
+        # async variant of stream_solution for the asgi entry point
+
+        prepared = await self._aprepare(query)
+
+        if prepared['cached_solution'] is not None:
+            for event in self._cached_events(prepared['cached_solution']):
+                yield event
+            return
+
+        # links are ready long before the answer, send them right away
+        context_links = await asyncio.to_thread(self._create_context_links, prepared['top_sources'])
+        yield 'links', context_links
+
+        print('crafting an answer...')
+
+        answer, chunk = '', None
+        with span('gemini'), self._count_upstream_errors('gemini'):
+            async for chunk in await get_genai_client().aio.models.generate_content_stream(
+                model='gemini-2.0-flash',
+                contents = prepared['prompt_contents']
+            ):
+                if chunk.text:
+                    answer += chunk.text
+                    yield 'token', chunk.text
+        self._record_usage(chunk)
+
+        self._cache_solution(prepared, dict(answer = answer, links = context_links))
+        yield 'done', dict(answer = answer)
+
+
+    def _prepare(self, query):
+        # steps shared by every entry point up to the gemini call, returns a dict with the
+        # retrieval results and either the cached solution or the prompt for gemini
+
+        print('creating solution...') # report process
+
+        # get query text and optional image
+        query_text = query.get('question') or ''
         query_image_b64 = query.get('image')
 
         # image_description will be appended to student question to create a single embedding
         # image_prompts list will be directly sent to gemini later to craft answers along with the chunk texts
         image_description, image_prompts = self._get_image_description(query_image_b64, query_text)
 
-        # complete query content 
+        # complete query content
         query_content = query_text + image_description
 
-        # get indices and sources of top 5 most similar chunks based on cosine similarity 
+        print('embedding user query...')
+        query_embedding = Embedder().embed_content(query_content)
+
+        return self._retrieve(query_content, image_prompts, query_embedding)
+
+
+    async def _aprepare(self, query):
+        # async variant of _prepare, upstream calls are awaited
+
+        print('creating solution...') # report process
+
+        query_text = query.get('question') or ''
+        query_image_b64 = query.get('image')
+
+        image_description, image_prompts = await self._aget_image_description(query_image_b64, query_text)
+        query_content = query_text + image_description
 
         print('embedding user query...')
-        embedder = Embedder()
-        query_embedding = embedder.embed_content(query_content)
+        query_embedding = await Embedder().aembed_content(query_content)
+
+        # search, cache lookup and context packing are cpu bound numpy work, keep them off the event loop
+        return await asyncio.to_thread(self._retrieve, query_content, image_prompts, query_embedding)
 
-        # search through embedding database 
 
+    def _retrieve(self, query_content, image_prompts, query_embedding):
+
+        # search through embedding database
         print('searching through the embedded data...')
-        top_indices, top_sources = self._get_most_similar_indices(query_embedding)
+        top_indices, top_sources = self._get_most_similar_indices(query_embedding, query_content)
+
+        prepared = dict(
+            query_embedding = query_embedding,
+            image_prompts = image_prompts,
+            top_indices = top_indices,
+            top_sources = top_sources,
+            cached_solution = self._get_cached_solution(query_embedding, top_indices, image_prompts),
+            prompt_contents = None
+        )
+        if prepared['cached_solution'] is None:
+            # get context for gemini prompt
+            gemini_context = self._format_context_for_gemini(top_indices)
+            prepared['prompt_contents'] = self._build_answer_prompt(query_content, gemini_context, image_prompts)
+        return prepared
 
-        # get context for gemini prompt
-        gemini_context = self._format_context_for_gemini(top_indices)
 
-        # get answer from gemini
-        answer = self._get_answer_from_gemini(query_content, gemini_context, image_prompts)
+    def _cached_events(self, cached_solution):
+        # a cached solution streamed as the same events as a fresh answer
+        yield 'links', cached_solution['links']
+        yield 'token', cached_solution['answer']
+        yield 'done', dict(answer = cached_solution['answer'])
 
-        # create 'context_links' list containign source_url and text
-        context_links = self._create_context_links(top_sources)
 
-        print(answer)
+    def _get_cached_solution(self, query_embedding, top_indices, image_prompts):
+        # answers to queries with images depend on the images too, never reuse them
+        answer_cache = get_answer_cache()
+        if answer_cache is None or image_prompts:
+            return None
+        index_version = get_vector_index().version
+        with span('answer_cache'):
+            cached_solution = answer_cache.lookup(query_embedding, top_indices, index_version)
+        CACHE_LOOKUPS.inc('answer', 'miss' if cached_solution is None else 'hit')
+        if cached_solution is not None:
+            print('answer cache hit')
+        return cached_solution
 
-        return dict(
-            answer = answer,
-            links = context_links
-        )
+
+    def _cache_solution(self, prepared, solution):
+        answer_cache = get_answer_cache()
+        if answer_cache is None or prepared['image_prompts']:
+            return
+        answer_cache.store(prepared['query_embedding'], prepared['top_indices'], solution, get_vector_index().version)
 
 
     
-    def _get_answer_from_gemini(self, query_content, gemini_context, image_prompts):
+    def _get_answer_from_gemini(self, prompt_contents):
 
         print('crafting an answer...')
 
+        client = get_genai_client() # shared per worker, keeps its connections alive
+        with span('gemini'), self._count_upstream_errors('gemini'):
+            response = client.models.generate_content(
+                model='gemini-2.0-flash',
+                contents = prompt_contents
+            )
+        self._record_usage(response)
+        return response.text
+
+
+    async def _aget_answer_from_gemini(self, prompt_contents):
+
+        print('crafting an answer...')
+
+        client = get_genai_client()
+        with span('gemini'), self._count_upstream_errors('gemini'):
+            response = await client.aio.models.generate_content(
+                model='gemini-2.0-flash',
+                contents = prompt_contents
+            )
+        self._record_usage(response)
+        return response.text
+
+
+    @contextmanager
+    def _count_upstream_errors(self, upstream):
+        try:
+            yield
+        except Exception:
+            UPSTREAM_ERRORS.inc(upstream)
+            raise
+
+
+    def _record_usage(self, response):
+        # token counts reported by gemini, missing when the call failed or was cut short
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
+        TOKENS.inc('prompt', amount=usage.prompt_token_count or 0)
+        TOKENS.inc('answer', amount=usage.candidates_token_count or 0)
+
+
+    def _build_answer_prompt(self, query_content, gemini_context, image_prompts):
+
         text_prompt = (
             "You are a Retrieval-Augmented Generation (RAG) assistant. "
             "You've been provided with context snippets from an online forum that belongs to an educational institution. "
@@ -96,96 +309,70 @@ class SolutionCreator():
         if image_prompts:
             prompt_contents.extend(image_prompts)
 
-        client = genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'))
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents = prompt_contents
-        )
-        return response.text
+        return prompt_contents
 
         
 
     def _create_context_links(self, top_sources):
 
-        source_urls = list()
+        # unique source urls in retrieval order
+        source_urls = dict()
 
         for source_str in top_sources:
-            source_list = source_str.split('|')
-            source_urls.extend([url for url in source_list if url not in source_urls])
-
-        # preload the posts list 
-        with open('data/json/posts.json', 'r', encoding='utf-8') as f:
-            posts = json.load(f)
-
-        # context_links will be a list of dicts containing url and text
-        context_links = []
-
-        for source_url in source_urls:
-            if 'discourse.onlinedegree.iitm.ac.in' in source_url:
-                source_id = '/'.join(source_url.split('/')[-2:])
-                for post in posts:
-                    post_id = '/'.join(post['post_url'].split('/')[-2:])
-                    if source_id == post_id:
-                        context_links.append(dict(
-                            url = post['post_url'],
-                            text = post['markdown']
-                        ))
-                
-            elif 'tds.s-anand.net' in source_url:
-                source_id = source_url.split('/')[-1]
-                filepath = f'data/markdowns/course_content/{source_id}.md'
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    file_content = f.read()
-                context_links.append(dict(
-                    url = source_url,
-                    text = file_content
-                ))
-
-        return context_links
+            source_urls.update(dict.fromkeys(source_str.split('|')))
+
+        # resident lookup table, each source is a dict hit instead of a scan over posts.json
+        with span('index_load'):
+            context_store = get_context_store()
+        with span('links'):
+            return context_store.get_links(source_urls)
         
 
         
 
     def _format_context_for_gemini(self, top_indices):
 
-        with open('data/json/chunks.json', 'r', encoding='utf-8') as f:
-            chunks = json.load(f)
+        # memory-mapped chunk texts, a few slice reads instead of parsing chunks.json per request
+        with span('index_load'):
+            chunk_store = get_chunk_store()
+        with span('context'):
+            context_snippets = chunk_store.get_many(top_indices)
 
-        context_snippets = list()
-        for index in top_indices:
-            context_snippets.append(chunks[index])
+            # stitch splits of the same source, drop repeated posts and replies, pack to the budget
+            context, stats = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET).pack(context_snippets)
+        TOKENS.inc('context', amount=stats['context_tokens'])
+        TOKENS.inc('context_saved', amount=stats['saved_tokens'])
+        print(
+            f'context packed: {stats["chunks"]} chunks into {stats["blocks"]} blocks, '
+            f'{stats["context_tokens"]}/{stats["raw_tokens"]} tokens, {stats["saved_tokens"]} saved'
+        ) # report process
 
-        return '\n\n\n'.join(context_snippets)
+        return context
 
 
 
-    def _get_most_similar_indices(self, query_embedding, k=15):
+    def _get_most_similar_indices(self, query_embedding, query_text='', k=RETRIEVAL_K):
 
-        # load embeddings 
-        embed_data = np.load('embed_data.npz')
-        embeddings = embed_data['embeddings']
-        sources = embed_data['sources']
+        # resident search engine (exact, ivf or quantized), loaded once per worker instead of on every request
+        # loads and reloads are timed on their own so the search stage holds query time only
+        with span('index_load'):
+            index = get_search_engine()
+            bm25_index = get_bm25_index() if query_text else None
 
-        # Ensure query_embedding is 2D (1, n_features) for dot product
-        query_embedding = np.array(query_embedding)
-        query_embedding = query_embedding.reshape(1, -1)
-        
-        # Compute cosine similarity manually:
-        # 1. Dot product between query and embeddings (numerator)
-        dot_product = np.dot(embeddings, query_embedding.T).flatten()
-        
-        # 2. Norm of embeddings and query (denominator)
-        embeddings_norm = np.linalg.norm(embeddings, axis=1)
-        query_norm = np.linalg.norm(query_embedding)
-        
-        # 3. Cosine similarity = dot_product / (norm(embeddings) * norm(query))
-        cosine_similarities = dot_product / (embeddings_norm * query_norm)
-        
-        # Get indices of top k similarities (descending order)
-        top_k_indices = np.argsort(cosine_similarities)[-k:][::-1]
-        top_k_sources = sources[top_k_indices]
+        with span('search'):
+            if bm25_index is None:
+                # cosine similarity search over pre-normalized vectors
+                top_k_indices, _ = index.search(query_embedding, k)
+                top_k_indices = top_k_indices[top_k_indices >= 0] # ivf pads rows when probed lists hold fewer than k vectors
+            else:
+                # hybrid: exact tokens (assignment numbers, error strings, tool names) are found by bm25,
+                # both shortlists are fused by reciprocal rank so neither score scale dominates
+                dense_indices, _ = index.search(query_embedding, max(k, HYBRID_CANDIDATES))
+                lexical_indices, _ = bm25_index.search(query_text, max(k, HYBRID_CANDIDATES))
+                top_k_indices = reciprocal_rank_fusion([dense_indices[dense_indices >= 0], lexical_indices], k)
+            top_k_sources = index.sources[top_k_indices]
 
-        return top_k_indices, top_k_sources
+            return top_k_indices, top_k_sources
 
 
         
@@ -194,6 +381,49 @@ class SolutionCreator():
         if not query_image:
             return '', []
 
+        prompt_contents, image_prompts = self._build_image_prompt(query_image, query_text)
+
+        # get response from gemini
+        try:
+            client = get_genai_client()
+            with span('image_description'):
+                response = client.models.generate_content(
+                    model='gemini-2.0-flash-lite',
+                    contents = prompt_contents
+                )
+            self._record_usage(response)
+            image_description = f'Image Description:\n{response.text}'
+            return image_description, image_prompts
+        except:
+            UPSTREAM_ERRORS.inc('gemini')
+            return '', []
+
+
+    async def _aget_image_description(self, query_image, query_text):
+        # return empty string if no image passed in user query
+        if not query_image:
+            return '', []
+
+        prompt_contents, image_prompts = self._build_image_prompt(query_image, query_text)
+
+        # get response from gemini
+        try:
+            client = get_genai_client()
+            with span('image_description'):
+                response = await client.aio.models.generate_content(
+                    model='gemini-2.0-flash-lite',
+                    contents = prompt_contents
+                )
+            self._record_usage(response)
+            image_description = f'Image Description:\n{response.text}'
+            return image_description, image_prompts
+        except:
+            UPSTREAM_ERRORS.inc('gemini')
+            return '', []
+
+
+    def _build_image_prompt(self, query_image, query_text):
+
         # create list of b64 codes of query images
         if isinstance(query_image, str):
             images_b64 = [query_image]
@@ -225,6 +455,9 @@ class SolutionCreator():
 
         image_prompts = list()
 
+        # imported here, the sdk is slow to import and most queries carry no image
+        from google.genai import types
+
         # create image prompts 
         for image_bytes in decoded_images:
             mime = filetype.guess_mime(image_bytes)
@@ -233,15 +466,10 @@ class SolutionCreator():
         
         prompt_contents = [text_prompt] + image_prompts
 
-        # get response from gemini
-        try:
-            client = genai.Client(api_key=os.environ.get('GOOGLE_API_KEY'))
-            response = client.models.generate_content(
-                model='gemini-2.0-flash-lite',
-                contents = prompt_contents
-            )
-            image_description = f'Image Description:\n{response.text}'
-            return image_description, image_prompts
-        except:
-            return '', []
+        return prompt_contents, image_prompts
         
+
+
+def format_sse(event, data):
+    # one server-sent event, data is json so multi-line answer text stays on one line
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+
+
+class VectorIndex:
+
+    def __init__(self, embeddings, sources, normalized=False):
+        # keep unit-length float32 vectors so cosine similarity becomes a plain dot product
+        if normalized: # already unit length on disk (memory-mapped store), use as is without copying
+            self.embeddings = embeddings
+        else:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0 # avoid division by zero for empty vectors
+            self.embeddings = embeddings / norms
+        self.sources = np.asarray(sources)
+        self.version = None # identifies the file the vectors came from, set by the loaders
+        self.fingerprint = None # identifies the vectors themselves, see content_fingerprint()
+
+
+    @classmethod
+    def from_npz(cls, path='embed_data.npz'):
+        embed_data = np.load(path)
+        index = cls(embed_data['embeddings'], embed_data['sources'])
+        index.version = file_version(path)
+        if 'hashes' in embed_data.files: # chunk content hashes, one per row
+            index.fingerprint = hashlib.sha256('\n'.join(embed_data['hashes'].tolist()).encode('utf-8')).hexdigest()
+        return index
+
+
+    @classmethod
+    def from_store(cls, store_dir='embed_store'):
+        # the .npy file is memory-mapped read only, so every worker shares the same
+        # page-cache copy and startup does not read the matrix into process memory
+        embeddings = np.load(f'{store_dir}/embeddings.npy', mmap_mode='r')
+        with open(f'{store_dir}/sources.json', 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        index = cls(embeddings, sources, normalized=True)
+        index.version = file_version(f'{store_dir}/embeddings.npy')
+        if os.path.exists(f'{store_dir}/fingerprint'):
+            with open(f'{store_dir}/fingerprint', 'r', encoding='utf-8') as f:
+                index.fingerprint = f.read().strip()
+        return index
+
+
+    def write_store(self, store_dir='embed_store'):
+        os.makedirs(store_dir, exist_ok=True)
+
+        # fingerprint of the rows first, a worker that maps the new embeddings always reads it too
+        fingerprint_path = f'{store_dir}/fingerprint'
+        with open(f'{fingerprint_path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.content_fingerprint())
+        os.replace(f'{fingerprint_path}.tmp', fingerprint_path)
+
+        # write to temporary files first so running workers never map a half-written file
+        embeddings_path = f'{store_dir}/embeddings.npy'
+        with open(f'{embeddings_path}.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.embeddings, dtype=np.float32), allow_pickle=False)
+        os.replace(f'{embeddings_path}.tmp', embeddings_path)
+
+        # metadata sidecar with the source urls of each row
+        sources_path = f'{store_dir}/sources.json'
+        with open(f'{sources_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.sources.tolist(), f)
+        os.replace(f'{sources_path}.tmp', sources_path)
+
+
+    def content_fingerprint(self):
+        # saved by the indexes derived from these vectors (ivf, quantized) so they can tell when
+        # they are stale even if the row count did not change: the digest of the chunk content
+        # hashes when the embeddings file has them, otherwise of the sources and a sample of rows
+        if self.fingerprint is None:
+            digest = hashlib.sha256(str(self.embeddings.shape).encode('utf-8'))
+            digest.update('\n'.join(self.sources.tolist()).encode('utf-8'))
+            step = max(1, len(self) // 4096)
+            digest.update(np.ascontiguousarray(self.embeddings[::step], dtype=np.float32).tobytes())
+            self.fingerprint = digest.hexdigest()
+        return self.fingerprint
+
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+
+    def search(self, query_vec, k=15):
+        # single query is just a batch of one
+        query = np.asarray(query_vec, dtype=np.float32).reshape(1, -1)
+        top_k_indices, top_k_scores = self.search_batch(query, k)
+        return top_k_indices[0], top_k_scores[0]
+
+
+    def search_batch(self, query_vecs, k=15, block_size=65536):
+        # normalize every query row once, the stored vectors are already normalized
+        queries = np.asarray(query_vecs, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        query_norms[query_norms == 0] = 1.0
+        queries = queries / query_norms
+
+        n_queries = queries.shape[0]
+        n_vectors = len(self)
+        k = min(k, n_vectors)
+        if k <= 0: # argpartition with -0 would select every column, nothing was asked for
+            return np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=np.float32)
+
+        # running top k candidates for every query row
+        best_indices = np.empty((n_queries, 0), dtype=np.int64)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+
+        # score the corpus block by block so peak memory stays at (M, block_size)
+        for start in range(0, n_vectors, block_size):
+            block = self.embeddings[start:start + block_size]
+            scores = queries @ block.T # one GEMM for all queries against this block
+
+            # partial selection of the top k inside the block, no full sort
+            block_k = min(k, scores.shape[1])
+            part = np.argpartition(scores, -block_k, axis=1)[:, -block_k:]
+            part_scores = np.take_along_axis(scores, part, axis=1)
+
+            # merge with candidates kept from previous blocks
+            cand_indices = np.concatenate([best_indices, part + start], axis=1)
+            cand_scores = np.concatenate([best_scores, part_scores], axis=1)
+            if cand_scores.shape[1] > k:
+                keep = np.argpartition(cand_scores, -k, axis=1)[:, -k:]
+                cand_indices = np.take_along_axis(cand_indices, keep, axis=1)
+                cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            best_indices, best_scores = cand_indices, cand_scores
+
+        # only the final k per row get sorted (descending order)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        top_k_indices = np.take_along_axis(best_indices, order, axis=1)
+        top_k_scores = np.take_along_axis(best_scores, order, axis=1)
+        return top_k_indices, top_k_scores
+
+
+
+def file_version(path):
+    # changes whenever the file is rewritten, used to invalidate anything derived from it
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def stored_fingerprint(path):
+    # embeddings fingerprint saved in a derived index file, None for files written before fingerprints
+    if not os.path.exists(path):
+        return None
+    index_data = np.load(path)
+    return str(index_data['fingerprint']) if 'fingerprint' in index_data.files else None
+
+
+# process-wide index, loaded once per worker and shared by all requests
+# the files are re-checked every INDEX_RELOAD_INTERVAL seconds so a rebuilt index is picked up
+INDEX_RELOAD_INTERVAL = float(os.environ.get('INDEX_RELOAD_INTERVAL', 60))
+
+_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_vector_index(path='embed_data.npz', store_dir='embed_store'):
+    global _index, _index_checked_at
+    if _index is None or time.monotonic() - _index_checked_at > INDEX_RELOAD_INTERVAL:
+        with _index_lock:
+            # another thread may have loaded or checked it while we waited
+            if _index is None or time.monotonic() - _index_checked_at > INDEX_RELOAD_INTERVAL:
+                _index_checked_at = time.monotonic()
+                _index = _load_vector_index(path, store_dir, _index)
+    return _index
+
+
+def _load_vector_index(path, store_dir, current):
+    # prefer the shared memory-mapped store, the .npz is decompressed per worker
+    store_path = f'{store_dir}/embeddings.npy'
+    source = store_path if os.path.exists(store_path) else path
+    if current is not None and current.version == file_version(source):
+        return current
+
+    try:
+        index = VectorIndex.from_store(store_dir) if source == store_path else VectorIndex.from_npz(path)
+    except (OSError, ValueError) as e:
+        if current is None:
+            raise
+        print(f'ERROR reloading {source}, keeping the loaded index: {e}') # e.g. caught mid-rewrite
+        return current
+    print(f'vector index loaded with {len(index)} vectors')
+    return index
+
+
+# search engine used by the serving path: 'exact' brute force, 'ivf' approximate search
+# or 'quantized' compressed codes with an exact rerank
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_search_engine(engine=None, ivf_path='ivf_index.npz', quantized_path='quantized_index.npz'):
+    global _engine
+    index = get_vector_index()
+    # rebuild the engine whenever the underlying vector index was (re)loaded
+    if _engine is None or _engine_index(_engine) is not index:
+        with _engine_lock:
+            if _engine is None or _engine_index(_engine) is not index:
+                _engine = _load_search_engine(engine or os.environ.get('SEARCH_ENGINE', 'exact'), ivf_path, quantized_path, index)
+    return _engine
+
+
+def _engine_index(engine):
+    return getattr(engine, 'vector_index', engine)
+
+
+def _load_search_engine(engine, ivf_path, quantized_path, index):
+    if engine == 'quantized':
+        from quantized_index import QuantizedIndex
+        rerank = int(os.environ.get('QUANTIZED_RERANK', 100))
+        try:
+            engine = QuantizedIndex.load(index, quantized_path, rerank=rerank)
+            print(f'{engine.fmt} index loaded with {engine.dims} dimensions and rerank={rerank}')
+            return engine
+        except (OSError, ValueError) as e: # missing or stale index, keep serving with exact search
+            print(f'ERROR loading {quantized_path}, falling back to exact search: {e}')
+            return index
+
+    if engine != 'ivf':
+        return index
+
+    from ivf_index import IVFIndex
+    nprobe = int(os.environ.get('IVF_NPROBE', 8))
+    try:
+        engine = IVFIndex.load(index, ivf_path, nprobe=nprobe)
+        print(f'ivf index loaded with nprobe={nprobe}')
+        return engine
+    except (OSError, ValueError) as e: # missing or stale index, keep serving with exact search
+        print(f'ERROR loading {ivf_path}, falling back to exact search: {e}')
+        return index